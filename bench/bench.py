@@ -0,0 +1,293 @@
+# bench.py
+# benchmarks every Clinix command over synthetic corpora of different shapes
+
+"""
+Generates synthetic corpora, times each Clinix command (and some pipes of them)
+over them through both eval() and do(), and records throughput and peak memory
+
+Run from anywhere:
+
+    python bench/bench.py --output results.json
+    python bench/bench.py --output new.json --compare results.json
+
+Each case is run --repeat times and the fastest run is kept. Peak memory is measured
+in one extra run with tracemalloc, so that tracing doesn't slow down the timed runs
+Results are written as JSON, so runs from before and after a change can be compared
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import clinix
+from cat import cat
+from grep import grep
+from ls import ls
+from rev import rev
+from sort import sort
+from tac import tac
+from uniq import uniq
+from wc import wc, numpy as wc_numpy
+
+WORDS = ['error', 'warning', 'info', 'debug', 'request', 'response', 'timeout', 'user',
+         'session', 'cache', 'disk', 'network', 'retry', 'ok', 'failed', 'started']
+
+def random_line(rng, n_words):
+    """
+    a line of n_words random words, with a number thrown in
+    """
+
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    words.insert(rng.randrange(n_words + 1), str(rng.randrange(100000)))
+    return ' '.join(words)
+
+def write_file(path, rng, size, n_words):
+    """
+    writes a file of lines of about n_words words each, until it is at least size bytes
+    """
+
+    written = 0
+    with open(path, 'w') as f:
+        while written < size:
+            line = random_line(rng, n_words) + '\n'
+            f.write(line)
+            written += len(line)
+
+def make_corpora(root, scale):
+    """
+    makes each corpus under root, with sizes multiplied by scale
+
+    returns a dict of corpus name to the list of paths to give commands for it
+    """
+
+    rng = random.Random(1234)
+    corpora = {}
+
+    path = os.path.join(root, 'small')
+    os.makedirs(path)
+    for i in range(int(2000 * scale)):
+        write_file(os.path.join(path, 'f{:05}.log'.format(i)), rng, 4 << 10, 8)
+    corpora['small'] = [os.path.join(path, '*.log')]
+
+    path = os.path.join(root, 'huge')
+    os.makedirs(path)
+    for i in range(2):
+        write_file(os.path.join(path, 'f{}.log'.format(i)), rng, int((64 << 20) * scale), 8)
+    corpora['huge'] = [os.path.join(path, '*.log')]
+
+    path = os.path.join(root, 'longlines')
+    os.makedirs(path)
+    write_file(os.path.join(path, 'f.log'), rng, int((16 << 20) * scale), 20000)
+    corpora['longlines'] = [os.path.join(path, 'f.log')]
+
+    path = os.path.join(root, 'deep')
+    for depth in range(20):
+        path = os.path.join(path, 'd{}'.format(depth))
+        os.makedirs(path)
+        for i in range(max(1, int(50 * scale))):
+            write_file(os.path.join(path, 'f{}.log'.format(i)), rng, 2 << 10, 8)
+    corpora['deep'] = [os.path.join(root, 'deep')]
+
+    return corpora
+
+def corpus_size(paths, recurse=False):
+    """
+    returns the total bytes and lines in the files of a corpus
+    """
+
+    n_bytes = 0
+    n_lines = 0
+    for path in clinix.expand_files(paths, recurse=recurse, filesonly=True):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(clinix.BLOCK_SIZE), b''):
+                n_bytes += len(block)
+                n_lines += block.count(b'\n')
+    return n_bytes, n_lines
+
+def cases(paths, recurse):
+    """
+    returns (name, function making the command) for each case to run over a corpus
+    """
+
+    if recurse:
+        return [
+            ('grep', lambda: grep('timeout', *paths, r=True)),
+            ('grep -n jobs=4', lambda: grep('timeout', *paths, r=True, n=True, jobs=4)),
+            ('grep | wc', lambda: grep('timeout', *paths, r=True) | wc()),
+        ]
+    cases = [
+        ('grep', lambda: grep('timeout', *paths)),
+        ('grep -i -n', lambda: grep('TIMEOUT', *paths, i=True, n=True)),
+        ('grep -v', lambda: grep('e', *paths, v=True)),
+        ('grep mmap', lambda: grep('timeout', *paths, mmap=True)),
+        ('grep compact', lambda: grep('e', *paths, compact=True)),
+        ('grep jobs=4', lambda: grep('timeout', *paths, jobs=4)),
+        ('grep -c', lambda: grep('timeout', *paths, c=True)),
+        ('grep -l', lambda: grep('timeout', *paths, l=True)),
+        ('wc', lambda: wc(*paths)),
+        ('cat', lambda: cat(*paths)),
+        ('cat -n', lambda: cat(*paths, n=True)),
+        ('cat lines', lambda: cat(*paths, lines=(1000, 2000))),
+        ('tac', lambda: tac(*paths)),
+        ('rev', lambda: rev(*paths)),
+        ('sort', lambda: sort(*paths)),
+        ('sort -k -n S=16M jobs=4', lambda: sort(*paths, k=1, n=True, S=16 << 20, jobs=4)),
+        ('ls', lambda: ls(*[os.path.dirname(path) for path in paths])),
+        ('grep | wc', lambda: grep('timeout', *paths) | wc()),
+        ('grep | uniq -c', lambda: grep('timeout', *paths) | uniq(c=True, unsorted=True)),
+        ('cat | grep', lambda: cat(*paths) | grep('timeout')),
+        ('cat | tac | rev', lambda: cat(*paths) | tac() | rev()),
+    ]
+    if wc_numpy is not None:
+        cases.append(('wc numpy', lambda: wc(*paths, numpy=True)))
+    return cases
+
+def run_eval(command):
+    """
+    runs a command through eval(), consuming everything it returns
+    """
+
+    deque(command.eval(), maxlen=0)
+
+def run_do(command):
+    """
+    runs a command through do(), writing its output nowhere
+    """
+
+    (command > os.devnull).do()
+
+def measure(make_command, run, repeat):
+    """
+    runs a case repeat times, then once more under tracemalloc
+
+    returns the fastest wall time and its cpu time, and the peak traced memory in bytes
+    """
+
+    best_wall = None
+    best_cpu = None
+    for _ in range(repeat):
+        command = make_command()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        run(command)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        if best_wall is None or wall < best_wall:
+            best_wall = wall
+            best_cpu = cpu
+    command = make_command()
+    tracemalloc.start()
+    try:
+        run(command)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best_wall, best_cpu, peak
+
+def git_commit():
+    """
+    the commit the benchmarked code is at, or None if it can't be found
+    """
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scale, repeat, only=None):
+    """
+    makes the corpora, runs every case over each of them, and returns the results as a dict
+    """
+
+    results = []
+    root = tempfile.mkdtemp(prefix='clinix-bench-')
+    try:
+        corpora = make_corpora(root, scale)
+        for corpus, paths in corpora.items():
+            recurse = corpus == 'deep'
+            n_bytes, n_lines = corpus_size(paths, recurse)
+            for name, make_command in cases(paths, recurse):
+                if only and not any(o in name for o in only):
+                    continue
+                for mode, run in (('eval', run_eval), ('do', run_do)):
+                    wall, cpu, peak = measure(make_command, run, repeat)
+                    result = {
+                        'corpus': corpus,
+                        'case': name,
+                        'mode': mode,
+                        'wall': wall,
+                        'cpu': cpu,
+                        'bytes': n_bytes,
+                        'lines': n_lines,
+                        'mb_per_s': n_bytes / (1 << 20) / wall if wall else None,
+                        'lines_per_s': n_lines / wall if wall else None,
+                        'peak_memory': peak,
+                    }
+                    results.append(result)
+                    print_result(result)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scale': scale,
+        'repeat': repeat,
+        'results': results,
+    }
+
+def print_result(result, baseline=None):
+    """
+    prints one result as a line of a table, with the speedup over baseline if there is one
+    """
+
+    line = '{:10} {:18} {:5} {:9.3f}s {:9.1f} MB/s {:12.0f} lines/s {:9.1f} MB peak'.format(
+        result['corpus'], result['case'], result['mode'], result['wall'],
+        result['mb_per_s'] or 0, result['lines_per_s'] or 0, result['peak_memory'] / (1 << 20))
+    if baseline:
+        line += '  {:5.2f}x'.format(baseline['wall'] / result['wall'])
+    print(line)
+
+def compare(run, baseline):
+    """
+    prints each result of run next to how much faster it was than the same case in baseline
+    """
+
+    old = {(r['corpus'], r['case'], r['mode']): r for r in baseline['results']}
+    print('compared to {} ({})'.format(baseline.get('commit'), baseline.get('time')))
+    for result in run['results']:
+        print_result(result, old.get((result['corpus'], result['case'], result['mode'])))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the size of every corpus by this')
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each case, keeping the fastest')
+    parser.add_argument('--only', action='append', help='only run cases whose names contain this (may be repeated)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='a JSON file of earlier results to compare against')
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.scale, args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(run, json.load(f))
+
+if __name__ == '__main__':
+    main()
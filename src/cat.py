@@ -2,24 +2,22 @@
 # emulates the cat tool
 
 import clinix
+import itertools
+import lineindex
+import locale
+import os
 from collections import namedtuple
 
 CatSuccess = namedtuple('CatSuccess', 'file contents')
 CatError = namedtuple('CatError', 'file reason')
 
-class CatCommand(clinix.ClinixCommand):
+class CatCommand(clinix.LineCommand):
     """
     Class to represent a cat command
     """
 
-    def __init__(self, args, options):
-        """
-        args is a list of files to output 
-        options is a dict of options to cat
-        """
-
-        super().__init__(options)
-        self.filenames = args
+    success = CatSuccess
+    error = CatError
 
     def parse_options(self, options):
         """
@@ -27,67 +25,177 @@ class CatCommand(clinix.ClinixCommand):
         """
 
         self.number = options.get('number', False) or options.get('n', False)
+        self.lines = options.get('lines', None)
+        if self.lines is not None:
+            first, last = self.lines
+            self.lines = (max(first, 1), last)
+        self.sidecar = options.get('sidecar', False)
 
-    def cat_one(self, filename):
+    def file_output(self, filename):
         """
-        cat's a single file
+        lazily yields the lines of a single file in chunks, possibly numbered
 
-        returns either CatSuccess or CatError
+        when numbering, the line breaks in the file are counted first (a block at a time, without 
+        decoding it), since how wide to pad the numbers depends on how many lines there are
         """
 
-        try:
-            with open(filename) as f:
-                lines = f.read().splitlines()
-                lines = self.cat_lines(lines)
-                return CatSuccess(filename, '\n'.join(lines))
-        except IOError as e:
-            return CatError(filename, e.strerror)
+        if self.lines is not None and not clinix.is_compressed(filename):
+            return self.indexed_output(filename)
+        if self.number:
+            self.start_numbering(self.count_lines(filename))
+            if self.lines is not None:
+                self.linenum = self.lines[0]
+        return super().file_output(filename)
 
-    def cat_lines(self, lines):
+    def file_chunks(self, filename):
         """
-        returns the given lines, possibly modified based on the options to cat
+        lazily yields the lines of a single file in lists, only the ones in self.lines if it was given
+
+        raises IOError if the file can't be read
         """
+
+        chunks = super().file_chunks(filename)
+        if self.lines is None:
+            return chunks
+        first, last = self.lines
+        return clinix.batched(itertools.islice(itertools.chain.from_iterable(chunks), first - 1, last))
+
+    def indexed_output(self, filename):
+        """
+        lazily yields the lines in self.lines of a single file in chunks, possibly numbered, reading just those
+        lines straight from where the file's line index (see lineindex.line_index) says they are
+
+        raises IOError if the file can't be read
+        """
+
+        index = lineindex.line_index(filename, self.sidecar)
+        first, last = self.lines
+        last = len(index) if last is None else min(last, len(index))
         if self.number:
-            lines = list(enumerate(lines, 1))
-            max_num_len = len(str(len(lines))) # longest length of any number (e.g. 482 -> 3)
-            # 4 spaces, then line number padded with spaces on left, then 2 spaces, then actual line
-            lines = [str(linenum).rjust(4 + max_num_len) + '  ' + line for linenum, line in lines]
-        return lines
+            self.start_numbering(len(index))
+            self.linenum = first
+        encoding = locale.getpreferredencoding(False) # what open() would have decoded the file with
+        with self.open_file(filename, 'rb') as f:
+            for n in range(first, last + 1, clinix.LINE_BATCH):
+                start, stop = index.line_span(n, min(n + clinix.LINE_BATCH - 1, last))
+                f.seek(start)
+                text = f.read(stop - start).decode(encoding)
+                if '\r' in text: # split like reading the file as text would, see clinix.LINE_BREAK
+                    text = text.replace('\r\n', '\n').replace('\r', '\n')
+                lines = text.split('\n')
+                if text.endswith('\n'):
+                    lines.pop()
+                self.stats.lines += len(lines)
+                yield self.transform_lines(lines)
+
+    def count_lines(self, filename):
+        """
+        how many lines filename has, split the way reading it as text does (see clinix.LINE_BREAK),
+        counting a last line without a line break
+
+        raises IOError if the file can't be read
+        """
 
-    def cat_stdin(self):
+        lines = 0
+        last = b'\n'
+        with self.open_file(filename, 'rb') as f:
+            for block in iter(lambda: f.read(clinix.BLOCK_SIZE), b''):
+                lines += block.count(b'\n')
+                if b'\r' in block or last == b'\r':
+                    # a '\r' is a line break of its own, unless it's followed by '\n' (even in the next block)
+                    lines += block.count(b'\r') - block.count(b'\r\n') - (last == b'\r' and block[:1] == b'\n')
+                last = block[-1:]
+        return lines + (last not in (b'\n', b'\r'))
+
+    def start_numbering(self, count):
         """
-        cat's stdin
+        starts numbering lines from 1 again, for a file (or stdin) of count lines
+        """
+
+        self.linenum = 1
+        # 4 spaces, then line number padded with spaces on left (to the length of the biggest one, e.g. 482 -> 3)
+        self.numwidth = 4 + len(str(count))
 
-        Currently always returns CatSucess
+    def transform_lines(self, lines):
+        """
+        returns the given lines, possibly modified based on the options to cat
         """
 
-        return CatSuccess('-', '\n'.join(self.cat_lines(self.read_stdin().splitlines())))
+        if not self.number:
+            return lines
+        first = self.linenum
+        self.linenum += len(lines)
+        # then 2 spaces, then actual line
+        return [str(linenum).rjust(self.numwidth) + '  ' + line for linenum, line in zip(itertools.count(first), lines)]
 
-    def eval(self):
+    def stdin_output(self):
         """
-        returns a Python representation of the result of this command
+        cat's stdin, in chunks
+
+        when numbering, all of stdin has to be read first to know how many lines it has
         """
-    
-        filenames = clinix.expand_files(self.filenames)
-        if filenames:
-            return [self.cat_one(f) for f in filenames]
+
+        first, last = self.lines or (1, None)
+        if not self.number:
+            lines = itertools.islice(self.iter_stdin(), first - 1, last)
         else:
-            return [self.cat_stdin()]
+            lines = list(self.iter_stdin())
+            self.start_numbering(len(lines))
+            self.linenum = first
+            lines = lines[first - 1:last]
+        return (self.transform_lines(chunk) for chunk in clinix.batched(lines))
+
+    def copy_to(self, outfile):
+        """
+        copies the files given to cat straight into outfile (a binary file) in the kernel,
+        without their contents going through Python
+
+        only done when there are files and no options that change their contents
+        the output is laid out like writing str(self): each file ends with a newline, errors are written inline,
+        and if there's nothing at all, it's just a newline. But the files are copied byte for byte, so unlike
+        str(self), their line endings aren't translated (a '\\r\\n' stays '\\r\\n') and nothing is decoded
+        compressed files are decompressed through Python instead, since there's nothing for the kernel to copy
+        """
 
-    def __str__(self):
+        if self.number or self.lines is not None:
+            return False
+        filenames = list(clinix.expand_files(self.filenames))
+        if not filenames:
+            return False
+        empty = True
+        for filename in filenames:
+            try:
+                compressed = clinix.is_compressed(filename)
+                with self.open_file(filename, 'rb') as f:
+                    if compressed:
+                        last = b'\n'
+                        for block in iter(lambda: f.read(clinix.BLOCK_SIZE), b''):
+                            outfile.write(block)
+                            last = block[-1:]
+                            empty = False
+                        if last != b'\n':
+                            outfile.write(b'\n')
+                        continue
+                    size = clinix.copy_file(f, outfile)
+                    if size:
+                        empty = False
+                        if os.pread(f.fileno(), 1, size - 1) != b'\n':
+                            outfile.write(b'\n')
+            except IOError as e:
+                outfile.write((filename + ': ' + e.strerror + '\n').encode())
+                empty = False
+        if empty:
+            outfile.write(b'\n')
+        return True
+
+    def pipe_files(self):
         """
-        Outputs each of the files given to cat
+        without numbering, what cat sends down a pipe is just the lines of its files
         """
-        
-        def singlestr(arg):
-            if isinstance(arg, CatSuccess):
-                return arg.contents
-            elif isinstance(arg, CatError):
-                return arg.file + ': ' + arg.reason
-            else:
-                raise Exception("Don't know how to handle cat result " + arg.__class__.__name__)
 
-        return '\n'.join(singlestr(arg) for arg in self.eval())
+        if self.number or self.lines is not None or not self.filenames:
+            return None
+        return list(clinix.expand_files(self.filenames))
 
 def cat(*args, **options):
     """
@@ -97,6 +205,14 @@ def cat(*args, **options):
     Valid options (with defaults):
         n=False, number=False:
             output line numbers as well
+        lines=None:
+            if given as (first, last), only output lines first through last of each file (counting from 1,
+            last may be None for the end of the file). These are read straight from where they are
+            in the file, using an index of where its lines are (kept in memory, see lineindex)
+        sidecar=False:
+            if True, the line indexes used for lines are also saved next to each file, so they last between runs
+
+    when redirected to a file without any options, the files are copied in the kernel
     """
 
     return CatCommand(args, options)
@@ -3,10 +3,51 @@
 import __main__
 import sys
 import os
-from collections import namedtuple, Iterable
+import asyncio
+import io
+import itertools
+import mmap
+import queue
+import threading
+import zlib
+import bz2
+import lzma
+import errno
+import shutil
+import time
+import contextlib
+import concurrent.futures
+import fnmatch
+import re
+from collections import namedtuple, OrderedDict, deque
+from collections.abc import Iterable
 import glob
 
 InputType = namedtuple('InputType', 'type source')
+FollowPosition = namedtuple('FollowPosition', 'ino offset lines') # how far follow mode has read a file
+
+BLOCK_SIZE = 1 << 20 # size of the blocks that files are read and scanned in when not going line by line
+OUTPUT_BUFFER_SIZE = 1 << 16 # size of the buffer output files are written through
+CACHE_SIZE = 64 << 20 # default cap on the memory used by a command's result cache
+WALK_THREADS = min(32, (os.cpu_count() or 1) + 4) # default number of threads listing directories while recursing
+WALK_AHEAD = 4 # how many directory listings per thread are made ahead of the one being yielded
+ASYNC_BATCH = 256 # how many results aeval() takes from a thread at a time
+FOLLOW_INTERVAL = 1.0 # default seconds between rounds of poll() and watch()
+LINE_BATCH = 4096 # how many lines a LineCommand transforms at a time when they don't come from a block of a file
+DECOMPRESS_THREADS = os.cpu_count() or 1 # threads decompressing the members of a gzip file at once
+GZIP_CHUNK_SIZE = 8 << 20 # roughly how much of a gzip file each of those threads decompresses at a time
+DECOMPRESS_AHEAD = 4 # how many decompressed blocks each of them can get ahead of the ones being read
+GZIP_PIECE_SIZE = 1 << 16 # how much compressed data zlib is given at a time by those threads
+LINE_BREAK = re.compile(rb'\r\n?|\n') # what ends a line of a file opened as text (with universal newlines)
+
+# what the start of each kind of compressed file looks like, and how to make a decompressor for one of its streams
+# (bz2's magic is just 'BZh', which text can start with too, so its block size and the magic of the block
+# or end of stream after it are checked as well)
+COMPRESSIONS = {
+    'gzip': (re.compile(b'\x1f\x8b'), lambda: zlib.decompressobj(zlib.MAX_WBITS | 16)),
+    'bz2': (re.compile(b'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'), bz2.BZ2Decompressor),
+    'xz': (re.compile(b'\xfd7zXZ\x00'), lzma.LZMADecompressor),
+}
 
 class ClinixCommand:
     """
@@ -32,10 +73,10 @@ class ClinixCommand:
     return empty string from __repr__ so that no additional output is produced in the REPR 
     other than the output from the command, e.g. if it prints to screen or writes to a file.
 
-    .do() actually calls .__str__() on itself and writes the result to this command's stdout,
-    whether it be sys.stdout, or a file, or possibly something else in the future. 
-    So __str__ is actually when the command is evaluated, but returns a string of what should be 
-    written to stdout/a file/whatever
+    .do() actually evaluates the command a line at a time through .iter_output(), writing each 
+    chunk to this command's stdout as soon as it is made, whether it be sys.stdout, or a file, 
+    or possibly something else in the future. .__str__() evaluates it the same way, but returns 
+    a string of everything that would be written to stdout/a file/whatever
 
     The goal is to be able to execute commands saved in variables multiple times, like an alias in a shell
 
@@ -57,11 +98,36 @@ class ClinixCommand:
         Set the commands stdin, stdout, and stderr
         And call _parse_options to set the command's options, which should
         be handled by the subclass that invoked this
+
+        The options every command takes are handled here:
+            cache=False
+                if True, keep the results for each file from one run to the next, and only process
+                a file again if it has changed. May also be a ResultCache to share between commands
+                Only commands that work file by file (like wc and grep) use it
+            cachesize=CACHE_SIZE
+                roughly how many bytes of memory the cache may use
+            hook=None
+                if given, called as hook('start', stats) and hook('end', stats) around each run of
+                this command by do(), and around it running as a stage of a pipe, where stats
+                is the CommandStats of the run. Stages piped into this one use it too if they have none
+            follow=False
+                if True, remember how far each file was read, and only read what was appended to it since
+                on each later run (see follow_start). Only some commands (like wc and grep) follow files
         """
 
         self.stdin = InputType('stdin', sys.stdin)
         self.stdout = sys.stdout
         self.stderr = sys.stderr
+        self.options = options
+        self.hook = options.get('hook', None)
+        self.stats = CommandStats(self)
+        cache = options.get('cache', False)
+        if cache is True:
+            cache = ResultCache(options.get('cachesize', CACHE_SIZE))
+        self.cache = cache or None
+        self.follow = options.get('follow', False)
+        self.positions = {} # filename to its FollowPosition, in follow mode
+        self.output = None # (device, inode) of the file do() is writing to, while it is
         self.parse_options(options)
 
     def parse_options(self, options):
@@ -73,6 +139,62 @@ class ClinixCommand:
 
         pass
 
+    def cache_key(self):
+        """
+        Returns what, besides the file itself, the result of this command for a file depends on
+
+        By default, the type of command and its options. Subclasses should add anything else, like arguments
+        """
+
+        options = sorted((k, v) for k, v in self.options.items() if k not in ('cache', 'cachesize', 'jobs', 'hook'))
+        return (type(self).__name__, repr(options))
+
+    def follow_start(self, filename, f):
+        """
+        In follow mode, where to start reading filename, just opened as f: the FollowPosition
+        the last run got to, or the start of the file (offset and lines 0) if it wasn't read before,
+        or was rotated (a different file, by inode, has its name now) or truncated since
+        Files that can't be seeked (like pipes and compressed files) are always read from the start
+        """
+
+        if not f.seekable():
+            return FollowPosition(None, 0, 0)
+        st = os.fstat(f.fileno())
+        position = self.positions.get(filename)
+        if position is None or position.ino != st.st_ino or st.st_size < position.offset:
+            position = FollowPosition(st.st_ino, 0, 0)
+        return position
+
+    def cache_lookup(self, filename):
+        """
+        Looks filename up in the cache, as it is right now
+
+        Returns the key it is cached under and its cached result, or None if there isn't one
+        files are identified by path, inode, size, and modification time, so any change to one is noticed
+        The key is None if the file can't be looked at
+        """
+
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None, None
+        key = (os.path.abspath(filename), st.st_ino, st.st_size, st.st_mtime_ns, self.cache_key())
+        return key, self.cache.get(key)
+
+    def cached(self, filename, process):
+        """
+        Returns process(filename), from the cache if it has a result for this version of the file
+
+        process must return a finished result (e.g. a list rather than a generator)
+        """
+
+        key, result = self.cache_lookup(filename)
+        if result is None:
+            result = process(filename)
+            if key is not None:
+                self.cache.put(key, result)
+        return result
+
     def __gt__(self, new_stdout):
         """
         >>> comm() > 'file.txt'
@@ -100,6 +222,10 @@ class ClinixCommand:
 
         Returns this command
 
+        The file is written from its end, but isn't opened with O_APPEND, so that files can still
+        be copied into it in the kernel (see copy_file). So unlike >> in a shell, two programs appending
+        to the same file at the same time can overwrite each other's output
+
         Note that this syntax differs from most shells as it uses >= 
         for appending to a file and not >>
         This is because >> and > have different precedent levels 
@@ -139,6 +265,10 @@ class ClinixCommand:
         Then comm2's __ror__ is invoked (ClinixCommands should not implement __or__)
         The input source of comm2 is set to be comm1, and comm2 is returned. 
 
+        Nothing is evaluated here: at evaluation time comm2 pulls comm1's output
+        one line at a time through comm1.iter_lines(), so comm2 can start working
+        before comm1 is done, and the full output of comm1 is never held in memory
+
         Other types can also be piped to ClinixCommands (provided they don't implement __or__,
         because if they do they will steal the operator for themselves)
 
@@ -150,48 +280,301 @@ class ClinixCommand:
         self.stdin = InputType('pipe', source)
         return self
 
-    def read_stdin(self):
+    def iter_stdin(self):
         """
-        Gets the value of this commands stdin
+        Lazily yields the lines of this commands stdin, without trailing newlines
 
-        If it is actually stdin, just reads from stdin
-        If we have been piped to, call str on the input source and use those lines
-            (if a list was piped to use, call str on its elements and join with newlines)
+        If it is actually stdin, reads stdin a line at a time
+        If it is a file, reads the file a line at a time
+        If we have been piped to by another ClinixCommand, yields from its pipe_lines(), 
+            timing it as the stage before this one (see traced_lines)
+        If we have been piped to by anything else, call str on the input source and use those lines
+            (if a list was piped to use, use its elements one at a time, taking the lines 
+            straight out of result records like GrepSuccess, see record_lines)
+        """
+
+        for line in self.stdin_lines():
+            self.stats.lines += 1
+            yield line
+
+    def stdin_lines(self):
+        """
+        The lines of stdin for iter_stdin, before counting them
         """
 
         if self.stdin.type == 'stdin':
-            return self.stdin.source.read()
+            for line in self.stdin.source:
+                yield line.rstrip('\n')
         elif self.stdin.type == 'file':
             try:
-                with open(self.stdin.source) as infile:
-                    return infile.read()
+                with self.open_file(self.stdin.source) as infile:
+                    for line in infile:
+                        yield line.rstrip('\n')
             except IOError as e:
-                raise Exception('Error reading file ' + infile + ': ' + e.strerror)
+                raise Exception('Error reading file ' + self.stdin.source + ': ' + e.strerror)
         elif self.stdin.type == 'pipe':
             source = self.stdin.source
-            if isinstance(source, Iterable) and not isinstance(source, str):
-                source = '\n'.join(str(s) for s in source)
-            return str(source)
+            if isinstance(source, ClinixCommand):
+                yield from source.traced_lines(self)
+            elif isinstance(source, Iterable) and not isinstance(source, str):
+                for s in source:
+                    yield from record_lines(s)
+            else:
+                yield from str(source).splitlines()
         else:
             raise Exception('Unknown stdin type: ' + self.stdin.type)
 
+    def stdin_command(self):
+        """
+        Returns the ClinixCommand piped to this one, or None if it wasn't piped to by a command
+
+        Commands can use this to work straight from the command before them rather than its lines
+        """
+
+        if self.stdin.type == 'pipe' and isinstance(self.stdin.source, ClinixCommand):
+            return self.stdin.source
+        return None
+
+    def read_stdin(self):
+        """
+        Gets the value of this commands stdin as one string
+
+        Prefer iter_stdin(), which doesn't hold all of stdin in memory at once
+        """
+
+        return '\n'.join(self.iter_stdin())
+
+    def iter_lines(self):
+        """
+        Lazily yields the lines of output of this command, without trailing newlines
+
+        Should be implemented by the subclass. This is what gets read when this command 
+        is piped to another one, and what __str__ joins together
+        """
+
+        raise NotImplementedError
+
+    def __str__(self):
+        """
+        Evaluates this command and returns everything it would output as one string
+        """
+
+        return '\n'.join(self.iter_lines())
+
+    def pipe_lines(self):
+        """
+        Lazily yields the lines this command sends down a pipe to another command
+
+        By default, the same lines as iter_lines(). Commands whose output lines are just a field of
+        their eval() records yield those fields straight from the records, so formatting them 
+        only happens in the last command of a pipe, the one actually writing output
+        """
+
+        return self.iter_lines()
+
+    def pipe_files(self):
+        """
+        If the lines this command sends down a pipe are just the lines of some files, one after 
+        another, returns a list of those files, otherwise None
+
+        The command piped to can then read those files itself, in one pass, without this
+        command running at all. A file that can't be read stands for the one line 
+        '<filename>: <reason>'. By default, None
+        """
+
+        return None
+
+    def traced_lines(self, downstream):
+        """
+        Yields from pipe_lines() as the stage of a pipe before the command downstream
+
+        Starts a new self.stats, linked to as downstream.stats.upstream, and counts into it 
+        only the time spent making each line, not the time downstream spends on it
+        so each stage's times include the stages before it, but not the ones after it
+        """
+
+        hook = self.hook or downstream.hook
+        stats = self.stats = CommandStats(self)
+        self.output = downstream.output # whatever the pipe writes to can't be read by any stage of it
+        downstream.stats.upstream = stats
+        if hook:
+            hook('start', stats)
+        lines = self.pipe_lines()
+        try:
+            while True:
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    break
+                finally:
+                    stats.wall += time.perf_counter() - wall
+                    stats.cpu += time.process_time() - cpu
+                stats.results += 1
+                yield line
+        finally:
+            lines.close()
+            if hook:
+                hook('end', stats)
+
+    def iter_output(self):
+        """
+        Lazily yields the output of this command in chunks, exactly as they should be written
+
+        Together they are the same as str(self) + '\n'
+        """
+
+        empty = True
+        for line in self.iter_lines():
+            empty = False
+            self.stats.results += 1
+            yield line + '\n'
+        if empty and not self.follow: # a round of follow mode with nothing new in it outputs nothing
+            yield '\n'
+
+    def poll(self, interval=FOLLOW_INTERVAL, rounds=None):
+        """
+        >>> for result in comm(follow=True).poll():
+
+        Lazily yields the results of eval() over and over, a round every interval seconds, forever or
+        for rounds rounds. With follow, each round only has what was added to the files since the last
+        """
+
+        for round in range(rounds) if rounds is not None else itertools.count():
+            if round:
+                time.sleep(interval)
+            yield from self.eval()
+
+    def watch(self, interval=FOLLOW_INTERVAL, rounds=None):
+        """
+        >>> (comm(follow=True) >= 'out.txt').watch()
+
+        Like poll(), but runs do() each round, so with follow the new output is written as it turns up
+        like tail -f. Stop it with Ctrl-C, or give rounds
+        """
+
+        for round in range(rounds) if rounds is not None else itertools.count():
+            if round:
+                time.sleep(interval)
+            self.do()
+
     def do(self):
         """
         Forces execution of this command. This should be a repeatable operation.
 
-        Writes to the proper output channel as well
-        calls __str__ on itself to determine what to write
+        Writes to the proper output channel as well, a chunk at a time as iter_output() makes them, 
+        so output starts right away and the whole of it is never held in memory
+        Files are written through a buffer of OUTPUT_BUFFER_SIZE, and closed when done
+        An input file that is the file being written to is an error ('input file is output file', see open_file)
+        rather than read, since it would keep reading back what was just written to it
+
+        Afterwards, self.stats is a CommandStats of this run (and through it, of each stage piped into this one)
         """
 
-        if isinstance(self.stdout, str):
-            mode = 'w' if self.overwrite_stdout else 'a'
-            outfile = open(self.stdout, mode) # TODO: close
-        elif self.stdout == sys.stdout:
-            outfile = self.stdout
-        else:
-            raise Exception("Can't write to " + self.stdout)
-        output = str(self) + '\n'
-        outfile.write(output)
+        stats = self.stats = CommandStats(self)
+        if self.hook:
+            self.hook('start', stats)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            if isinstance(self.stdout, str):
+                opener = None if self.overwrite_stdout else append_opener
+                with open(self.stdout, 'w', buffering=OUTPUT_BUFFER_SIZE, opener=opener) as outfile:
+                    if not self.overwrite_stdout:
+                        try:
+                            outfile.seek(0, os.SEEK_END)
+                        except OSError:
+                            pass # e.g. a pipe, which has no end to seek to, and is only ever written at its end anyway
+                    st = os.fstat(outfile.fileno())
+                    self.output = (st.st_dev, st.st_ino)
+                    if not self.copy_to(outfile.buffer):
+                        self.write_output(outfile)
+            elif self.stdout == sys.stdout:
+                self.write_output(self.stdout)
+            else:
+                raise Exception("Can't write to " + str(self.stdout))
+        finally:
+            self.output = None
+            stats.wall = time.perf_counter() - wall
+            stats.cpu = time.process_time() - cpu
+            if self.hook:
+                self.hook('end', stats)
+
+    async def ado(self, executor=None):
+        """
+        >>> await comm().ado()
+
+        Like do(), but for use in an asyncio event loop: the command runs on a thread of executor
+        (by default the event loop's default one), so reading its files doesn't block the loop,
+        and many commands and pipes can run at once
+        """
+
+        await asyncio.get_running_loop().run_in_executor(executor, self.do)
+
+    async def aeval(self, executor=None):
+        """
+        >>> async for result in comm().aeval():
+
+        Like eval(), but an async iterator for use in an asyncio event loop: the command is evaluated
+        on threads of executor (by default the event loop's default one), ASYNC_BATCH results at a time,
+        so reading its files doesn't block the loop. eval() itself is called on one of them too, since
+        some commands (like wc) work everything out before returning
+        """
+
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(executor, lambda: iter(self.eval()))
+        try:
+            while True:
+                batch = await loop.run_in_executor(executor, take, results, ASYNC_BATCH)
+                if not batch:
+                    break
+                for result in batch:
+                    yield result
+        finally:
+            if hasattr(results, 'close'): # which may have to wait for things like worker processes to stop
+                await loop.run_in_executor(executor, results.close)
+
+    def write_output(self, outfile):
+        """
+        Writes each chunk of output of this command to outfile as it is made
+        """
+
+        for chunk in self.iter_output():
+            outfile.write(chunk)
+        outfile.flush()
+
+    @contextlib.contextmanager
+    def open_file(self, filename, mode='r'):
+        """
+        Opens filename for reading like open_input(), counting it and the bytes read from it in self.stats
+
+        Bytes read are counted as they are actually read from the file (see CountingReader), so reading
+        only part of it (like tac with n does) counts only that part, and for compressed files it's
+        the compressed bytes that are counted
+        raises IOError if the file can't be read, or is the file this command's output is being written to
+        """
+
+        with open_input(filename, mode) as (f, raw):
+            if self.output is not None:
+                st = os.fstat(raw.fileno())
+                if (st.st_dev, st.st_ino) == self.output:
+                    raise IOError(errno.EINVAL, 'input file is output file')
+            self.stats.files_opened += 1
+            try:
+                yield f
+            finally:
+                self.stats.bytes_read += raw.count
+
+    def copy_to(self, outfile):
+        """
+        Writes the output of this command straight into outfile, a binary file, if this command 
+        can do that without reading its input into Python, e.g. by copying files in the kernel
+
+        Returns whether it did. By default commands can't, and do() falls back to writing str(self)
+        """
+
+        return False
 
     def __repr__(self):
         """
@@ -204,6 +587,337 @@ class ClinixCommand:
         self.do()
         return ''
 
+class LineCommand(ClinixCommand):
+    """
+    A command (like cat, rev, or tac) whose output is the lines of each of its files, or of stdin,
+    put through transform_lines()
+
+    Lines are worked on in chunks: a file is read a block (BLOCK_SIZE) at a time, and all the lines
+    in the block are transformed at once, so the per-line work is a tight loop (or a C call) over a list.
+    Output is written a whole chunk at a time, rather than a line at a time
+
+    Subclasses set success and error to their result records, implement transform_lines(),
+    and can change how each file's lines are read by overriding file_output()
+    """
+
+    success = None # namedtuple of the output of one file, with fields file and contents
+    error = None # namedtuple of a file that couldn't be read, with fields file and reason
+
+    def __init__(self, args, options):
+        """
+        args is a list of files to output
+        options is a dict of options to the command
+        """
+
+        super().__init__(options)
+        self.filenames = args
+
+    def transform_lines(self, lines):
+        """
+        returns a chunk of output lines, from lines, a list of consecutive lines of one file (or stdin)
+
+        By default they're left as they are
+        """
+
+        return lines
+
+    def file_chunks(self, filename):
+        """
+        lazily yields the lines of a single file in lists, a block of the file at a time, without newlines
+
+        raises IOError if the file can't be read
+        """
+
+        with self.open_file(filename) as f:
+            rest = '' # the start of a line that continues into the next block
+            for block in iter(lambda: f.read(BLOCK_SIZE), ''):
+                lines = (rest + block).split('\n')
+                rest = lines.pop()
+                if lines:
+                    self.stats.lines += len(lines)
+                    yield lines
+            if rest:
+                self.stats.lines += 1
+                yield [rest]
+
+    def file_output(self, filename):
+        """
+        lazily yields the output of a single file, in chunks (lists of lines)
+
+        raises IOError if the file can't be read
+        """
+
+        for lines in self.file_chunks(filename):
+            yield self.transform_lines(lines)
+
+    def stdin_output(self):
+        """
+        lazily yields the output for stdin, in chunks (lists of lines)
+        """
+
+        for lines in batched(self.iter_stdin()):
+            yield self.transform_lines(lines)
+
+    def input_chunks(self):
+        """
+        lazily yields the lines of all the files given (or of stdin), one file after another, in lists
+        and an error record for each file that couldn't be read, for commands whose output isn't file by file
+        """
+
+        filenames = list(expand_files(self.filenames))
+        if not filenames:
+            yield from batched(self.iter_stdin())
+            return
+        for filename in filenames:
+            try:
+                yield from self.file_chunks(filename)
+            except IOError as e:
+                yield self.error(filename, e.strerror)
+
+    def iter_chunks(self):
+        """
+        lazily yields all the output of this command in chunks (lists of lines), each file's after 
+        the one before. A file that can't be read is the line '<filename>: <reason>'
+        """
+
+        filenames = list(expand_files(self.filenames))
+        if not filenames:
+            yield from self.stdin_output()
+            return
+        for filename in filenames:
+            try:
+                yield from self.file_output(filename)
+            except IOError as e:
+                yield [filename + ': ' + e.strerror]
+
+    def eval_file(self, filename):
+        """
+        the output of a single file, as a success or error record
+        """
+
+        try:
+            return self.success(filename, '\n'.join(itertools.chain.from_iterable(self.file_output(filename))))
+        except IOError as e:
+            return self.error(filename, e.strerror)
+
+    def eval(self):
+        """
+        returns a Python representation of the result of this command
+
+        a list of success (or error) records, one for each file given, or just one for stdin
+        """
+
+        filenames = list(expand_files(self.filenames))
+        if filenames:
+            return [self.eval_file(f) for f in filenames]
+        else:
+            return [self.success('-', '\n'.join(itertools.chain.from_iterable(self.stdin_output())))]
+
+    def iter_lines(self):
+        """
+        Outputs each of the files given with their lines transformed, a line at a time
+        """
+
+        for lines in self.iter_chunks():
+            yield from lines
+
+    def iter_output(self):
+        """
+        Yields the output of this command a chunk at a time, rather than a line at a time
+        """
+
+        empty = True
+        for lines in self.iter_chunks():
+            if lines:
+                empty = False
+                self.stats.results += len(lines)
+                yield '\n'.join(lines) + '\n'
+        if empty:
+            yield '\n'
+
+class CommandStats:
+    """
+    Statistics about a run of a command, as self.stats of the command after do()
+
+    wall and cpu are the seconds the run took
+    bytes_read, lines, and files_opened count the input this command read itself 
+    results counts the lines of output it produced
+    If another command was piped into this one, upstream is the CommandStats of that command's run,
+    and stages lists the stats of every command in the pipe from first to last
+    Each stage's times include the stages piped into it, own_wall and own_cpu don't
+    """
+
+    def __init__(self, command):
+        self.command = type(command).__name__
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.lines = 0
+        self.files_opened = 0
+        self.results = 0
+        self.upstream = None
+
+    @property
+    def stages(self):
+        stages = []
+        stats = self
+        while stats is not None:
+            stages.append(stats)
+            stats = stats.upstream
+        return stages[::-1]
+
+    @property
+    def own_wall(self):
+        return self.wall - (self.upstream.wall if self.upstream else 0.0)
+
+    @property
+    def own_cpu(self):
+        return self.cpu - (self.upstream.cpu if self.upstream else 0.0)
+
+    def add(self, other):
+        """
+        Adds the counts of input read in other into these stats, e.g. from a worker process
+        """
+
+        self.bytes_read += other.bytes_read
+        self.lines += other.lines
+        self.files_opened += other.files_opened
+
+    def __repr__(self):
+        return '\n'.join(
+            '{}: {:.3f}s wall ({:.3f}s own), {:.3f}s cpu ({:.3f}s own), {} bytes read, {} lines, {} files opened, {} results'.format(
+                stats.command, stats.wall, stats.own_wall, stats.cpu, stats.own_cpu,
+                stats.bytes_read, stats.lines, stats.files_opened, stats.results
+            ) for stats in self.stages
+        )
+
+class ResultCache:
+    """
+    A least-recently-used cache of the results of commands for single files
+
+    Holds roughly at most maxbytes of results, evicting the least recently used ones
+    to make room. hits and misses count the lookups that did and didn't find a result
+    """
+
+    def __init__(self, maxbytes=CACHE_SIZE):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict() # key -> (result, size), least recently used first
+
+    def get(self, key):
+        """
+        Returns the result cached for key, or None if there isn't one
+        """
+
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, result):
+        """
+        Caches result for key, unless it's bigger than the whole cache
+        """
+
+        size = result_size(result)
+        if size > self.maxbytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (result, size)
+        self.size += size
+        while self.size > self.maxbytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self):
+        """
+        Drops everything in the cache, and resets the counts of hits and misses
+        """
+
+        self.entries.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+def take(iterable, n):
+    """
+    returns a list of the next n things from iterable, or fewer if it runs out
+    """
+
+    return list(itertools.islice(iterable, n))
+
+def appended_blocks(f, offset):
+    """
+    lazily yields the rest of the binary file f from offset, a block at a time, with each block cut
+    after its last newline, for follow mode. A last line without a newline (which may still be being
+    written) isn't yielded at all, it's read again the next time, once it's been finished
+    """
+
+    if offset:
+        f.seek(offset)
+    rest = b''
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+        block = rest + block
+        end = block.rfind(b'\n') + 1
+        rest = block[end:]
+        if end:
+            yield block[:end]
+
+def batched(iterable, n=LINE_BATCH):
+    """
+    lazily yields the things in iterable in lists of n (the last one may be shorter)
+    """
+
+    iterator = iter(iterable)
+    while True:
+        batch = take(iterator, n)
+        if not batch:
+            return
+        yield batch
+
+def record_lines(record):
+    """
+    the lines of text a single object piped to a command stands for
+
+    result records with a line (like GrepSuccess) are just that line, ones with contents 
+    (like CatSuccess) are the lines of their contents, and anything else is the lines of str() of it
+    """
+
+    fields = getattr(record, '_fields', ())
+    if 'line' in fields:
+        return [record.line]
+    if 'contents' in fields:
+        return record.contents.split('\n')
+    return str(record).split('\n')
+
+def count_read(f, n):
+    """
+    counts n bytes as read from the file underneath the file object f (which may be text or buffered)
+    when they were read some other way than through it, like copying them in the kernel or mmap'ing them.
+    Does nothing if f wasn't opened by open_input(), so there's nothing counting its bytes
+    """
+
+    raw = getattr(f, 'buffer', f)
+    raw = getattr(raw, 'raw', raw)
+    if isinstance(raw, CountingReader):
+        raw.count += n
+
+def result_size(result):
+    """
+    roughly how many bytes of memory result takes up, counting what's in lists and tuples
+    """
+
+    size = sys.getsizeof(result)
+    if isinstance(result, (list, tuple)):
+        size += sum(result_size(r) for r in result)
+    return size
+
 def expand_files(filenames, **kwargs):
     """
     utility function for expanding a list of given files 
@@ -215,12 +929,24 @@ def expand_files(filenames, **kwargs):
             all filenames matching the given globs will be yielded. Ifa file doesn't contain * or ?, it will not be expanded
         recusre=False
             if True, expands to all files and directories under each directory given
+    options only used when recursing, with defaults:
+        include=()
+            if given, a glob or list of globs, and only files whose names match one of them are yielded
+        exclude=()
+            a glob or list of globs, and files and directories whose names match one of them are skipped,
+            along with everything under those directories (e.g. exclude=['.git', 'node_modules'])
+        maxdepth=None
+            if given, don't go more than this many directories down into each directory given
+        filesonly=False
+            if True, only yield files, not directories
+        threads=WALK_THREADS
+            how many threads list directories at once. Paths are yielded in the same order either way
     """
 
     for filename in filenames:
         yield from expand_file(filename, **kwargs)
 
-def expand_file(filename, expandglob=True, recurse=False):
+def expand_file(filename, expandglob=True, recurse=False, **walk_options):
     """
     expands a single filename by glob or recursing
     """
@@ -232,12 +958,12 @@ def expand_file(filename, expandglob=True, recurse=False):
     else:
         filenames = [filename]
     if recurse:
-        yield from recurse_files(filenames)
+        yield from recurse_files(filenames, **walk_options)
     else:
         for filename in filenames:
             yield filename
 
-def recurse_files(filenames):
+def recurse_files(filenames, **walk_options):
     """
     expands to all files and directories under the given directories
 
@@ -246,20 +972,462 @@ def recurse_files(filenames):
     """
 
     for filename in filenames:
-        yield from recurse_file(filename)
+        yield from recurse_file(filename, **walk_options)
 
-def recurse_file(filename):
+def recurse_file(filename, include=(), exclude=(), maxdepth=None, filesonly=False, threads=WALK_THREADS):
     """
     expands to all files and directories under the given directory
     
     if a file is given, just yields that file
     if a directory is given, yields each file and directory in the given directory
+    see expand_files for the options
     """
 
-    yield filename # os.walk doesn't yield the given file/dir
-    for path, dirs, files in os.walk(filename):
-        for d in dirs:
-            yield os.path.join(path, d)
-        for f in files:
-            yield os.path.join(path, f)
+    if isinstance(include, str):
+        include = [include]
+    if not (filesonly and os.path.isdir(filename)):
+        yield filename # walk_entries doesn't yield the given file/dir
+    for entry in walk_entries(filename, exclude, maxdepth, threads):
+        if is_dir(entry):
+            if not filesonly:
+                yield entry.path
+        elif not include or any(fnmatch.fnmatch(entry.name, pattern) for pattern in include):
+            yield entry.path
+
+def walk_entries(top, exclude=(), maxdepth=None, threads=WALK_THREADS):
+    """
+    yields an os.DirEntry for every file and directory under the directory top
+
+    they come in the same order as os.walk would give them: a directory's subdirectories,
+    then its files, then everything under each of the subdirectories in turn
+    The entries keep the file type (and stat, once it's asked for) that os.scandir found
+    while listing, so nothing has to be stat'd again. Symlinks to directories aren't followed,
+    and directories that can't be listed are skipped
+
+    Entries whose names match a glob in exclude are skipped without being descended into,
+    and directories maxdepth deep aren't descended into (with maxdepth 0, nothing under top is yielded)
+    With more than one thread, the next directories to be yielded are listed on a thread pool ahead of time,
+    so they are being read while the ones before them are yielded. Only WALK_AHEAD times threads listings
+    are made ahead at once, the directories after them are just kept as paths, like os.walk does
+    """
+
+    if maxdepth is not None and maxdepth < 1:
+        return
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    pool = concurrent.futures.ThreadPoolExecutor(threads) if threads > 1 else None
+    ahead = WALK_AHEAD * threads if pool is not None else 1
+    def scan(path):
+        if pool is not None:
+            return pool.submit(scan_dir, path)
+        future = concurrent.futures.Future()
+        future.set_result(scan_dir(path))
+        return future
+    try:
+        stack = [[top, 1, None]] # a directory, how deep the entries in it are, and its listing once it's started
+        started = 0 # how many directories in the stack have their listing started
+        while stack:
+            # start listing the directories that will be yielded next, always including the very next one
+            for item in reversed(stack):
+                if item[2] is None:
+                    if started >= ahead and item is not stack[-1]:
+                        break
+                    item[2] = scan(item[0])
+                    started += 1
+            _, depth, future = stack.pop()
+            started -= 1
+            dirs = []
+            files = []
+            for entry in future.result():
+                if any(fnmatch.fnmatch(entry.name, pattern) for pattern in exclude):
+                    continue
+                (dirs if is_dir(entry) else files).append(entry)
+            yield from dirs
+            yield from files
+            if maxdepth is None or depth < maxdepth:
+                subdirs = [entry.path for entry in dirs if not entry.is_symlink()]
+                stack.extend([path, depth + 1, None] for path in reversed(subdirs))
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def scan_dir(path):
+    """
+    lists the directory path with os.scandir, returning a list of os.DirEntry, or an empty list if it can't be listed
+
+    whether each entry is a directory is found out here too, so a stat that needs is done along with the listing
+    """
+
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return []
+    for entry in entries:
+        is_dir(entry)
+    return entries
+
+def is_dir(entry):
+    """
+    whether the os.DirEntry entry is a directory (or a symlink to one), False if that can't be found out
+    """
+
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+def count_newlines(buf, start, stop):
+    """
+    counts the newlines in buf[start:stop], where buf is bytes-like (such as an mmap)
+
+    the range is counted a block at a time, so only one block is ever copied out of buf
+    """
+
+    count = 0
+    while start < stop:
+        block_stop = min(stop, start + BLOCK_SIZE)
+        count += buf[start:block_stop].count(b'\n')
+        start = block_stop
+    return count
+
+def reverse_lines(f):
+    """
+    yields the lines of f, a seekable binary file, from last to first, as bytes without newlines
+
+    f is read backwards from its end a block at a time, so only one block and
+    the pieces of the line currently being put back together are held in memory
+    """
+
+    pos = f.seek(0, os.SEEK_END)
+    pieces = [] # pieces of the line being put together, last piece first
+    at_end = True # nothing is after the line being put together, so it may be what follows a trailing newline
+    while pos > 0:
+        size = min(BLOCK_SIZE, pos)
+        pos -= size
+        f.seek(pos)
+        lines = f.read(size).split(b'\n')
+        pieces.append(lines.pop())
+        if not lines: # no newline in this block, so the line goes on into the block before it
+            continue
+        line = b''.join(reversed(pieces))
+        if line or not at_end:
+            yield line
+        at_end = False
+        pieces = [lines.pop(0)]
+        yield from reversed(lines)
+    if pieces:
+        line = b''.join(reversed(pieces))
+        if line or not at_end:
+            yield line
+
+@contextlib.contextmanager
+def open_input(filename, mode='r'):
+    """
+    Opens filename for reading like open(), but a gzip, bz2, or xz compressed file (found by its magic bytes)
+    is decompressed as it is read. Gives the file to read, and the file actually opened
+
+    the decompressed file can't be seeked, mmap'd, or copied in the kernel, since it has no file descriptor
+    of its own, so anything that does those has to check is_compressed() first
+    The file actually opened is a CountingReader, so its count is how many bytes have been read from it
+    """
+
+    raw = CountingReader(io.FileIO(filename))
+    with io.BufferedReader(raw) as buffered:
+        kind = compression(buffered)
+        if kind is None:
+            if 'b' in mode:
+                yield buffered, raw
+            else:
+                with io.TextIOWrapper(buffered) as f:
+                    yield f, raw
+            return
+        with io.BufferedReader(BlockReader(decompressed_blocks(buffered, kind)), BLOCK_SIZE) as f:
+            if 'b' in mode:
+                yield f, raw
+            else:
+                with io.TextIOWrapper(f) as f:
+                    yield f, raw
+
+def compression(f):
+    """
+    the kind of compression ('gzip', 'bz2', or 'xz') the buffered binary file f is in, by its magic bytes,
+    or None if it isn't compressed. Doesn't move f along, and if f can be seeked, doesn't read into its buffer
+    either (so the magic bytes don't count as read, see CountingReader)
+    """
+
+    head = os.pread(f.fileno(), 16, 0) if f.seekable() else f.peek(16)
+    for kind, (magic, _) in COMPRESSIONS.items():
+        if magic.match(head):
+            return kind
+    return None
+
+def is_compressed(filename):
+    """
+    whether filename is a compressed file that open_input() would decompress
+    False if it can't be opened (whatever opens it next will report that)
+    """
+
+    try:
+        with open(filename, 'rb') as f:
+            return compression(f) is not None
+    except OSError:
+        return False
+
+class BlockReader(io.RawIOBase):
+    """
+    A raw binary file, read-only and unseekable, whose contents are the blocks of bytes from an iterator
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.block = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.block:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.block = memoryview(block)
+        n = min(len(b), len(self.block))
+        b[:n] = self.block[:n]
+        self.block = self.block[n:]
+        return n
+
+    def close(self):
+        if hasattr(self.blocks, 'close'):
+            self.blocks.close()
+        super().close()
+
+class CountingReader(io.RawIOBase):
+    """
+    A raw binary file that reads from another one (raw), counting in count how many bytes have been read from it
+    Bytes read some other way (like copied in the kernel) are added to count with count_read()
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        if n:
+            self.count += n
+        return n
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    @property
+    def name(self):
+        return self.raw.name
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+def decompressed_blocks(f, kind):
+    """
+    yields the decompressed contents of f, a binary file compressed with kind, a block at a time
+
+    a file can be a few compressed streams one after another (like gzip members, or logs that were
+    compressed and appended to), and they're all decompressed. Gzip files big enough to be split up
+    are decompressed on several threads at once, see gzip_blocks_parallel
+    raises IOError if the file isn't validly compressed
+    """
+
+    try:
+        if kind == 'gzip' and DECOMPRESS_THREADS > 1 and f.seekable() and \
+           os.fstat(f.fileno()).st_size >= 2 * GZIP_CHUNK_SIZE:
+            yield from gzip_blocks_parallel(f)
+        else:
+            yield from stream_blocks(f, kind)
+    except (zlib.error, lzma.LZMAError, EOFError) as e:
+        raise IOError(errno.EIO, 'invalid ' + kind + ' data: ' + str(e))
+    except OSError as e:
+        if e.strerror is None: # bz2 reports bad data as an OSError without an errno
+            raise IOError(errno.EIO, 'invalid ' + kind + ' data: ' + str(e))
+        raise
+
+def stream_blocks(f, kind):
+    """
+    decompresses the rest of f one stream after another, on this thread, yielding a block at a time
+    """
+
+    new_decompressor = COMPRESSIONS[kind][1]
+    decompressor = new_decompressor()
+    started = False # whether the current stream has been given any data
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+        while block:
+            started = True
+            data = decompressor.decompress(block)
+            if data:
+                yield data
+            if not decompressor.eof:
+                break
+            block = decompressor.unused_data
+            decompressor = new_decompressor()
+            started = False
+    if started and not decompressor.eof:
+        raise EOFError('compressed file ended before the end of its last stream')
+
+def gzip_blocks_parallel(f):
+    """
+    decompresses a gzip file of many members (like one from pigz, or from gzipped logs concatenated together)
+    on DECOMPRESS_THREADS threads at once, yielding the decompressed blocks in order
+
+    The file is cut into chunks of about GZIP_CHUNK_SIZE where the gzip magic shows up, and each is decompressed
+    member after member on its own thread (zlib lets go of the GIL). Each thread hands its chunk's output over
+    a block (of at most BLOCK_SIZE) at a time, and waits once it's DECOMPRESS_AHEAD blocks ahead of what's been
+    read, so however well the file was compressed, only so much of it is decompressed in memory at once
+    A chunk only counts if it ends exactly where its last member does, which means the next chunk starts
+    at a real member and not at bytes in the middle of one that just look like a header. From the first
+    chunk that doesn't, the rest of the file is decompressed on this thread instead (carrying on from the
+    member it stopped in), so files of a single member (or a few big ones) still come out right, just not faster
+    """
+
+    stop = threading.Event() # set once the blocks aren't wanted anymore, so the threads give up
+
+    def put(blocks, block):
+        while not stop.is_set():
+            try:
+                blocks.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise concurrent.futures.CancelledError()
+
+    def decompress(data, blocks):
+        try:
+            put(blocks, gunzip_chunk(data, lambda block: put(blocks, block)))
+        except concurrent.futures.CancelledError:
+            pass
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        offsets = [0]
+        while True:
+            offset = buf.find(b'\x1f\x8b\x08', offsets[-1] + GZIP_CHUNK_SIZE)
+            if offset == -1:
+                break
+            offsets.append(offset)
+        offsets.append(len(buf))
+        chunks = zip(offsets, offsets[1:])
+
+        def submit(start, end):
+            blocks = queue.Queue(DECOMPRESS_AHEAD)
+            pool.submit(decompress, buf[start:end], blocks)
+            return start, end, blocks
+
+        pool = concurrent.futures.ThreadPoolExecutor(DECOMPRESS_THREADS)
+        try:
+            pending = deque(itertools.starmap(submit, itertools.islice(chunks, DECOMPRESS_THREADS)))
+            while pending:
+                start, end, blocks = pending.popleft()
+                pending.extend(itertools.starmap(submit, itertools.islice(chunks, 1)))
+                block = blocks.get()
+                while not isinstance(block, tuple): # until what gunzip_chunk returned, once it's done
+                    yield block
+                    block = blocks.get()
+                whole, member, done = block
+                if not whole:
+                    stop.set()
+                    f.seek(start + member)
+                    for block in stream_blocks(f, 'gzip'):
+                        if done < len(block):
+                            yield block[done:]
+                        done = max(done - len(block), 0)
+                    return
+                count_read(f, end - start)
+        finally:
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def gunzip_chunk(data, put):
+    """
+    decompresses the gzip members in data, calling put with each block of at most BLOCK_SIZE decompressed
+
+    returns whether data ended exactly at the end of a member, and if it didn't, where in data the member
+    it stopped in started, and how much of that member was put (its output up to where data ran out or was invalid)
+    """
+
+    data = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        member = pos
+        done = 0
+        tail = b''
+        block = b''
+        try:
+            while not decompressor.eof:
+                if not tail:
+                    if pos == len(data) and not block:
+                        return False, member, done
+                    tail = data[pos:pos + GZIP_PIECE_SIZE] # given a piece at a time, so unconsumed_tail is never big
+                    pos += len(tail)
+                block = decompressor.decompress(tail, BLOCK_SIZE)
+                tail = decompressor.unconsumed_tail
+                if block:
+                    put(block)
+                    done += len(block)
+        except zlib.error:
+            return False, member, done
+        pos -= len(decompressor.unused_data)
+    return True, None, None
+
+def append_opener(path, flags):
+    """
+    an opener for open() that opens path to write like mode 'w' would, but without truncating it,
+    and without O_APPEND either (which os.copy_file_range and os.sendfile can't write to), for appending
+    to it by seeking to its end
+    """
+
+    return os.open(path, flags & ~os.O_TRUNC, 0o666)
+
+def copy_file(infile, outfile):
+    """
+    copies everything in infile to outfile, both binary files, from infile's start 
+    to wherever outfile currently is. Returns the number of bytes copied
+
+    the copy is done in the kernel with os.copy_file_range, or os.sendfile if that isn't 
+    supported for these files, and only goes through Python if neither of them is
+    what's copied in the kernel is counted as read from infile with count_read()
+    """
 
+    outfile.flush() # anything already written has to go before the copied bytes
+    in_fd = infile.fileno()
+    out_fd = outfile.fileno()
+    offset = 0
+    copies = []
+    if hasattr(os, 'copy_file_range'):
+        copies.append(lambda: os.copy_file_range(in_fd, out_fd, 1 << 30, offset))
+    if hasattr(os, 'sendfile'):
+        copies.append(lambda: os.sendfile(out_fd, in_fd, offset, 1 << 30))
+    for copy in copies:
+        try:
+            while True:
+                copied = copy()
+                if not copied:
+                    return offset
+                count_read(infile, copied)
+                offset += copied
+        except OSError:
+            pass # e.g. copying across filesystems or into a file opened for appending, try the next way
+    infile.seek(offset)
+    shutil.copyfileobj(infile, outfile, BLOCK_SIZE)
+    return infile.tell()
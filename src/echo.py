@@ -34,14 +34,15 @@ class EchoCommand(clinix.ClinixCommand):
         args = list(clinix.expand_files(self.args))
         return args
 
-    def __str__(self):
+    def iter_lines(self):
         """
         Outputs each of the args given to echo, one per line,
 
         although each object may take up more than one line
         """
 
-        return '\n'.join(str(arg) for arg in self.eval())
+        for arg in self.eval():
+            yield from str(arg).split('\n')
 
 def echo(*args, **options):
     """
@@ -2,11 +2,36 @@
 # emulates output of the grep command
 
 import clinix
+import contextlib
+import concurrent.futures
+import itertools
+import locale
+import mmap
+import os
 import re
-from collections import namedtuple
+import trigram
+from array import array
+from collections import namedtuple, deque
 
-GrepSuccess = namedtuple('GrepSuccess', 'file line linenum')
+try:
+    from re import _parser as sre_parse
+except ImportError: # before Python 3.11
+    import sre_parse
+
+GrepSuccess = namedtuple('GrepSuccess', 'file line linenum pattern', defaults=(None,))
 GrepError = namedtuple('GrepError', 'file reason')
+GrepCount = namedtuple('GrepCount', 'file count')
+GrepFile = namedtuple('GrepFile', 'file')
+
+# the options that change what grepping a single file gives, the only ones sent to worker processes
+# (others, like hook and cache, may not be picklable at all, or would be sent again with every file)
+MATCH_OPTIONS = ('i', 'ignorecase', 'F', 'fixedstrings', 'm', 'maxcount', 'l', 'fileswithmatches',
+                 'q', 'quiet', 'c', 'count', 'v', 'invertmatch', 'mmap')
+NOTHING = '(?!)' # a regex that never matches, what an empty list of patterns is compiled to
+# what in a regex can see past the line it's matching in, when searching a whole file at once:
+# \A, \Z, and lookaheads and lookbehinds (which could look at the newline, or the lines around it)
+CONTEXT_OPS = {sre_parse.ASSERT, sre_parse.ASSERT_NOT}
+CONTEXT_ATS = {sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END_STRING}
 
 class GrepCommand(clinix.ClinixCommand):
     """
@@ -15,7 +40,7 @@ class GrepCommand(clinix.ClinixCommand):
 
     def __init__(self, pattern, args, options):
         """
-        pattern is a regular expression to search each line for
+        pattern is a regular expression to search each line for, or a list of them
         args is a list of files to search
         options is a dict of options to grep
         """
@@ -23,103 +48,932 @@ class GrepCommand(clinix.ClinixCommand):
         super().__init__(options)
         self.compile_pattern(pattern)
         self.filenames = args
+        self.pattern_source = pattern # kept to rebuild this command in worker processes
 
     def parse_options(self, options):
         """
         processes options to grep
 
-        valid options are i, ignorecase, n, and linenumber
+        valid options are i, ignorecase, n, linenumber, v, invertmatch, F, fixedstrings, 
+        m, maxcount, l, fileswithmatches, q, quiet, c, count,
+        mmap, jobs, r, recurse, include, exclude, maxdepth, index, and compact
+        (and follow, like every command)
+        (f and patternfile are handled by grep() itself)
         """
 
         self.ignorecase = options.get('ignorecase', False) or options.get('i', False)
+        self.fixedstrings = options.get('fixedstrings', False) or options.get('F', False)
+        self.maxcount = options.get('maxcount', options.get('m', None))
+        self.fileswithmatches = options.get('fileswithmatches', False) or options.get('l', False)
+        self.quiet = options.get('quiet', False) or options.get('q', False)
+        self.count = options.get('count', False) or options.get('c', False)
         self.linenumber = options.get('linenumber', False) or options.get('n', False)
         self.invertmatch = options.get('invertmatch', False) or options.get('v', False)
+        self.mmap = options.get('mmap', False)
+        self.compact = options.get('compact', False)
+        self.jobs = options.get('jobs', 1)
+        self.recurse = options.get('recurse', False) or options.get('r', False)
+        self.index = options.get('index', None)
+        if isinstance(self.index, str):
+            self.index = trigram.TrigramIndex(self.index)
+        self.expand_options = {}
+        if self.recurse:
+            self.expand_options = {
+                'recurse': True,
+                'filesonly': True,
+                'include': options.get('include', ()),
+                'exclude': options.get('exclude', ()),
+                'maxdepth': options.get('maxdepth', None),
+            }
+        self.match_options = {k: v for k, v in options.items() if k in MATCH_OPTIONS}
 
     def compile_pattern(self, pattern):
         """
         compiles the given regex pattern, considering the options given
+
+        a list of patterns is compiled into a single regex, so each line is only searched once however 
+        many patterns there are. If they are all literal strings (or fixedstrings was given), it is 
+        built as a trie of them, so that the regex engine steps through them a character at a time 
+        like an Aho-Corasick automaton instead of trying each one in turn
+        Otherwise, each pattern is a named group of one big alternation. Patterns that can't be put
+        together like that (with backreferences, group names used twice, or global flags like (?i)
+        of their own) are kept apart in a PatternSet instead, and tried one after another
+        An empty list of patterns matches nothing, like grep -f /dev/null
         """
 
         flags = 0
         if self.ignorecase:
             flags |= re.IGNORECASE
+        self.patterns = None
+        self.literals = None
+        self.literal_texts = None
+        if isinstance(pattern, str):
+            if self.fixedstrings:
+                pattern = re.escape(pattern)
+        else:
+            self.patterns = list(pattern)
+            texts = self.patterns if self.fixedstrings else [literal_text(p, flags) for p in self.patterns]
+            if not self.patterns:
+                pattern = NOTHING
+            elif None not in texts:
+                # the text each literal matches, and (looked up by the text that matched) which pattern it was
+                self.literal_texts = texts
+                self.literals = {self.literal_key(t): p for t, p in reversed(list(zip(texts, self.patterns)))}
+                pattern = literal_trie_pattern(texts)
+            else:
+                pattern = '|'.join('(?P<p{}>{})'.format(i, p) for i, p in enumerate(self.patterns))
+                if any(refers_back(p, flags) for p in self.patterns) or not compiles(pattern, flags):
+                    self.pattern = PatternSet(self.patterns, flags)
+                    self.bytes_pattern = PatternSet([p.encode('utf-8') for p in self.patterns], flags | re.MULTILINE)
+                    self.line_by_line = True # a PatternSet only searches, it can't be run over a whole file
+                    return
         self.pattern = re.compile(pattern, flags)
+        # the same pattern for searching a whole memory-mapped file at once, where ^ and $ have to match at each line
+        self.bytes_pattern = re.compile(pattern.encode('utf-8'), flags | re.MULTILINE)
+        # whether the pattern can see past the line it's matching in, so the mmap engine has to search lines one by one
+        self.line_by_line = looks_past_line(pattern, flags)
+
+    def literal_key(self, literal):
+        """
+        what a literal pattern (or the text it matched) is looked up under in self.literals
+        """
 
-    def grep_file(self, filename):
+        return literal.lower() if self.ignorecase else literal
+
+    def matched_pattern(self, match):
+        """
+        given the match of self.pattern or self.bytes_pattern, returns which of the patterns matched
+
+        None if there was only the one pattern, or no match
+        """
+
+        if self.patterns is None or match is None:
+            return None
+        if isinstance(self.pattern, PatternSet):
+            pattern_set = self.pattern if isinstance(match.re.pattern, str) else self.bytes_pattern
+            return self.patterns[pattern_set.index(match)]
+        if self.literals is not None:
+            text = match.group()
+            if isinstance(text, bytes):
+                text = text.decode('utf-8', 'replace')
+            return self.literals.get(self.literal_key(text))
+        return self.patterns[int(match.lastgroup[1:])]
+
+    def cache_key(self):
+        """
+        the results for a file also depend on the pattern
+        """
+
+        return super().cache_key() + (self.pattern_source,)
+
+    def limit(self):
+        """
+        how many matches of a file are needed before grep can stop reading it, None if all of them are
+        """
+
+        if self.quiet or self.fileswithmatches:
+            return 1
+        return self.maxcount
+
+    def grep_one(self, filename):
+        """
+        greps a single file, yielding its results as the options ask for: each match (up to maxcount of them),
+        or a GrepFile for fileswithmatches, or a GrepCount for count, and any errors
+
+        the file is only read until those are known
+        """
+
+        if self.count and not self.follow: # in follow mode, only the new lines are counted, through grep_followed
+            try:
+                yield GrepCount(filename, self.count_file(filename))
+            except IOError as e:
+                yield GrepError(filename, e.strerror)
+        else:
+            yield from self.limit_results(filename, self.grep_file(filename))
+
+    def limit_results(self, filename, results):
+        """
+        turns all of the results for one file (or stdin) into the ones the options ask for (see grep_one),
+        and stops (and closes) results as soon as they are known
+        """
+
+        limit = self.limit()
+        found = 0
+        try:
+            if limit is None or limit > 0:
+                for result in results:
+                    if not isinstance(result, GrepSuccess):
+                        yield result
+                        continue
+                    found += 1
+                    if self.fileswithmatches:
+                        yield GrepFile(filename)
+                    elif not self.count:
+                        yield result
+                    if found == limit:
+                        break
+            if self.count:
+                yield GrepCount(filename, found)
+        finally:
+            results.close()
+
+    def count_file(self, filename):
+        """
+        counts the lines in filename that match (only up to maxcount), without making a GrepSuccess for any of them
+
+        raises IOError if the file couldn't be read
+        """
+
+        limit = self.limit()
+        if limit is not None and limit <= 0:
+            return 0
+        if self.use_mmap(filename):
+            with self.mapped(filename) as buf:
+                return sum(1 for _ in itertools.islice(self.numbered_spans(buf), limit))
+        count = 0
+        with self.open_file(filename) as file:
+            for line in file:
+                self.stats.lines += 1
+                if bool(self.pattern.search(line.rstrip('\n'))) ^ self.invertmatch:
+                    count += 1
+                    if count == limit:
+                        break
+        return count
+
+    def grep_file(self, filename, countlines=False):
         """
         tries to open filename, and yields all matching lines
 
         with some info about the lines
         if the file couldn't be opened, returns an error
+        if countlines is True, the generator returns how many lines the file had (otherwise it may just return None)
         """
 
+        if self.follow:
+            return (yield from self.grep_followed(filename))
+        if self.use_mmap(filename):
+            return (yield from self.grep_file_mmap(filename, countlines))
+
+        linenum = 0
         try:
-            with open(filename) as file:
+            with self.open_file(filename) as file:
                 for linenum, line in enumerate(file, 1): # count line numbers from 1
+                    self.stats.lines += 1
                     line = line.rstrip('\n') # remove trailing newline
-                    for line in self.grep_line(line):
-                        yield GrepSuccess(filename, line, linenum)
+                    for line, pattern in self.grep_line(line):
+                        yield GrepSuccess(filename, line, linenum, pattern)
+        except IOError as e:
+            yield GrepError(filename, e.strerror)
+        return linenum
+
+    def grep_followed(self, filename):
+        """
+        like grep_file, but in follow mode: only the lines appended to filename since the last run are searched,
+        numbered on from the lines before them. If the file was rotated or truncated, it is searched from the start
+
+        a last line without a newline isn't searched until it has one (see clinix.appended_blocks)
+        """
+
+        encoding = locale.getpreferredencoding(False) # what open() would have decoded the file with
+        linenum = 0
+        try:
+            with self.open_file(filename, 'rb') as file:
+                position = self.follow_start(filename, file)
+                offset, linenum = position.offset, position.lines
+                for block in clinix.appended_blocks(file, offset):
+                    lines = block.decode(encoding, 'replace').split('\n')
+                    lines.pop() # the block ends with a newline, so this is empty
+                    self.stats.lines += len(lines)
+                    for linenum, line in enumerate(lines, linenum + 1):
+                        if line.endswith('\r'):
+                            line = line[:-1]
+                        for line, pattern in self.grep_line(line):
+                            yield GrepSuccess(filename, line, linenum, pattern)
+                    offset += len(block)
+                    self.positions[filename] = position._replace(offset=offset, lines=linenum)
+        except IOError as e:
+            yield GrepError(filename, e.strerror)
+        return linenum
+
+    def grep_file_mmap(self, filename, countlines=False):
+        """
+        like grep_file, but memory-maps filename and searches the whole thing at once
+        with the bytes version of the pattern, instead of decoding and searching a line at a time
+
+        line boundaries are only looked for around each match, and line numbers are 
+        found by counting the newlines between one match and the next
+        """
+
+        try:
+            with self.mapped(filename) as buf:
+                return (yield from self.grep_buffer(filename, buf, countlines))
         except IOError as e:
             yield GrepError(filename, e.strerror)
+        return 0
+
+    def use_mmap(self, filename):
+        """
+        whether to search filename with the mmap engine: only if asked for, and not for compressed
+        files, which have to be decompressed as they're read (invert matches go line by line anyway)
+        """
+
+        return self.mmap and self.can_mmap(filename)
+
+    def can_mmap(self, filename):
+        """
+        whether filename can be searched with the mmap engine at all
+        """
+
+        return not self.invertmatch and not clinix.is_compressed(filename)
+
+    @contextlib.contextmanager
+    def mapped(self, filename):
+        """
+        memory-maps filename for reading, giving an mmap of it (or b'' if it is empty, since those can't be mapped)
+        """
+
+        with self.open_file(filename, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                clinix.count_read(file, len(buf))
+                yield buf
+
+    def numbered_spans(self, buf):
+        """
+        yields the line number, start and end offsets (without its line break), and the match
+        of each line in buf (bytes-like) that the pattern matches
+
+        lines are split the same way as a file opened as text: at '\\n', '\\r\\n', or a lone '\\r'. buf is searched
+        all at once, with line boundaries only looked for around each match, unless it has a '\\r' in it
+        or the pattern looks past the line it is matching in (see line_by_line), when each line is
+        searched on its own instead (see line_match_spans)
+        """
+
+        if self.line_by_line or buf.find(b'\r') != -1:
+            yield from self.line_match_spans(buf)
+            return
+        linenum = 1
+        counted = 0 # everything before this offset has been counted into linenum
+        pos = 0
+        while pos < len(buf):
+            match = self.bytes_pattern.search(buf, pos)
+            if not match:
+                break
+            if match.start() == len(buf) and buf[-1:] == b'\n': # after the last newline, where there's no line
+                break
+            start = buf.rfind(b'\n', 0, match.start()) + 1
+            stop = buf.find(b'\n', match.start())
+            if stop == -1:
+                stop = len(buf)
+            # a match running past the end of its line (e.g. on \s) only counts if the line matches on its own
+            if match.end() > stop:
+                match = self.bytes_pattern.search(buf[start:stop])
+            if match:
+                linenum += clinix.count_newlines(buf, counted, start)
+                counted = start
+                yield linenum, start, stop, match
+            pos = stop + 1
+
+    def line_match_spans(self, buf):
+        """
+        numbered_spans, searching each line of buf on its own, without its line break
+        """
+
+        for linenum, (start, stop) in enumerate(text_lines(buf), 1):
+            match = self.bytes_pattern.search(buf[start:stop])
+            if match:
+                yield linenum, start, stop, match
+
+    def grep_buffer(self, filename, buf, countlines=False):
+        """
+        yields a GrepSuccess for each line in buf (bytes-like) that the pattern matches
+
+        if countlines is True, returns how many lines buf has
+        """
+
+        encoding = locale.getpreferredencoding(False) # what open() would have decoded the file with
+        for linenum, start, stop, match in self.numbered_spans(buf):
+            yield GrepSuccess(filename, buf[start:stop].decode(encoding, 'replace'), linenum, self.matched_pattern(match))
+        if countlines:
+            return text_line_count(buf)
+
+    def grep_files_parallel(self, filenames):
+        """
+        greps filenames in a pool of self.jobs worker processes
+
+        yields the results in the same order as grepping the files one at a time would,
+        each file's results as soon as it and every file before it are done
+        only a few files per worker are handed out ahead of the one being waited on
+        """
+
+        filenames = iter(filenames)
+        pool = concurrent.futures.ProcessPoolExecutor(self.jobs)
+        try:
+            pending = deque()
+            for filename in itertools.islice(filenames, 4 * self.jobs):
+                pending.append(self.submit_file(pool, filename))
+            while pending:
+                key, future = pending.popleft()
+                results, stats = future.result()
+                if stats is not None:
+                    self.stats.add(stats)
+                if key is not None:
+                    self.cache.put(key, results)
+                for filename in itertools.islice(filenames, 1):
+                    pending.append(self.submit_file(pool, filename))
+                yield from results
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit_file(self, pool, filename):
+        """
+        starts grepping filename in pool
+
+        returns a future of its list of results and the stats of the worker that grepped it (None if none did),
+        and the key to cache the results under once they're done (None if they shouldn't be)
+        if the cache already has results for the file, it isn't sent to the pool at all
+        """
+
+        key = None
+        if self.cache is not None:
+            key, results = self.cache_lookup(filename)
+            if results is not None:
+                future = concurrent.futures.Future()
+                future.set_result((results, None))
+                return None, future
+        return key, pool.submit(grep_file_job, self.pattern_source, self.match_options, filename)
+
+    def index_query(self):
+        """
+        what a file needs to have in it for a line of it to match, for looking files up in the trigram index
+        """
+
+        if self.patterns is None:
+            return trigram.pattern_query([self.pattern_source], self.pattern.flags, self.fixedstrings)
+        if self.literals is not None:
+            return trigram.pattern_query(self.literal_texts, self.pattern.flags, True)
+        return trigram.pattern_query(self.patterns, self.pattern.flags, self.fixedstrings)
 
     def grep_line(self, line):
         """
-        returns matches found in a single line
+        returns matches found in a single line, as pairs of the line and which pattern 
+        matched it (see matched_pattern, always None with invertmatch)
         """
 
-        if bool(re.search(self.pattern, line)) ^ self.invertmatch:
-            yield line
+        match = self.pattern.search(line)
+        if bool(match) ^ self.invertmatch:
+            yield line, self.matched_pattern(match)
 
     def grep_stdin(self):
         """
         reads stdin and yields matches found
+
+        if the command piped to grep is just sending the lines of some files (like cat), 
+        grep reads those files itself instead, see grep_piped_files
+        """
+
+        source = self.stdin_command()
+        filenames = source.pipe_files() if source is not None else None
+        if filenames is not None:
+            yield from self.grep_piped_files(filenames)
+            return
+        for linenum, line in enumerate(self.iter_stdin(), 1): # count line numbers from 1
+            for line, pattern in self.grep_line(line):
+                yield GrepSuccess('<stdin>', line, linenum, pattern)
+
+    def grep_piped_files(self, filenames):
         """
+        greps the lines of filenames as if they had been piped to grep's stdin, in one pass
+        straight over the files with grep's own file searching (so e.g. mmap is used)
 
-        for linenum, line in enumerate(self.read_stdin().splitlines()):
-            for line in self.grep_line(line):
-                yield GrepSuccess('<stdin>', line, linenum)
+        line numbers carry on from one file to the next, and an unreadable file is the line 
+        the command piping them would have sent for it
+        """
+
+        offset = 0 # lines in the files before this one
+        for filename in filenames:
+            results = self.grep_file(filename, countlines=True)
+            while True:
+                try:
+                    result = next(results)
+                except StopIteration as stop:
+                    offset += stop.value
+                    break
+                if isinstance(result, GrepSuccess):
+                    yield result._replace(file='<stdin>', linenum=result.linenum + offset)
+                else:
+                    offset += 1
+                    for line, pattern in self.grep_line(filename + ': ' + result.reason):
+                        yield GrepSuccess('<stdin>', line, offset, pattern)
+
+    def pipe_lines(self):
+        """
+        the lines grep sends down a pipe are the matching lines themselves, taken straight
+        from the GrepSuccess records rather than going through the formatting in iter_lines
+        (unless line numbers were asked for, which are part of the lines)
+        """
+
+        if self.linenumber or self.quiet:
+            yield from self.iter_lines()
+            return
+        for result in self.eval():
+            if isinstance(result, GrepSuccess):
+                yield result.line
+            else:
+                yield self.result_str(result)
 
     def eval(self):
         """
         Returns a Python representation of the output of this command
 
-        Returns a list of GrepSuccess and GrepError objects
+        Returns a list of GrepSuccess, GrepFile, GrepCount, and GrepError objects
         yields each match from each file provided, or stdin if none provided
+        with quiet, stops at (and after yielding) the first match of all
+        with compact, they are all collected into a GrepResults instead (see compact_eval)
         """
 
-        filenames = list(clinix.expand_files(self.filenames))
-        if filenames:
+        if self.compact:
+            return self.compact_eval()
+        return self.results()
+
+    def results(self):
+        """
+        lazily yields the results of eval(), when not compact
+        """
+
+        results = self.grep_all()
+        if not self.quiet:
+            yield from results
+            return
+        try:
+            for result in results:
+                yield result
+                if isinstance(result, (GrepSuccess, GrepFile)) or isinstance(result, GrepCount) and result.count:
+                    return
+        finally:
+            results.close()
+
+    def grep_all(self):
+        """
+        yields the results of eval(), except for stopping at the first match with quiet
+        """
+
+        if not self.filenames:
+            yield from self.limit_results('<stdin>', self.grep_stdin())
+            return
+        filenames = self.target_files()
+        if self.follow: # each file has to be read from where this command got to in it, and only the new part
             for filename in filenames:
-                yield from self.grep_file(filename)
+                yield from self.grep_one(filename)
+            return
+        if self.jobs > 1:
+            yield from self.grep_files_parallel(filenames)
+        elif self.cache is not None:
+            for filename in filenames:
+                yield from self.cached(filename, lambda f: list(self.grep_one(f)))
         else:
-            yield from self.grep_stdin()
+            for filename in filenames:
+                yield from self.grep_one(filename)
+
+    def target_files(self):
+        """
+        lazily yields the files to grep, as they are found, leaving out any the index says can't have a match
+        (unless every file has a result even without a match, like with invertmatch and count)
+        """
+
+        filenames = clinix.expand_files(self.filenames, **self.expand_options)
+        if self.index is not None and not self.invertmatch and not self.count and not self.follow:
+            filenames = self.index.candidates(filenames, self.index_query())
+        return filenames
+
+    def compact_eval(self):
+        """
+        eval() with compact: all the results, collected into a GrepResults
+
+        Matches in files are put straight into it as where they are in their file, without making a GrepSuccess
+        (or with mmap, without even decoding them). Anything else (like stdin, compressed files, or the results
+        of the options that don't output matches) goes in as eval() would yield it
+        """
+
+        results = GrepResults()
+        plain = not (self.count or self.fileswithmatches or self.quiet or self.maxcount is not None)
+        if not self.filenames or not plain or self.follow or self.jobs > 1 or self.cache is not None:
+            results.extend(self.results())
+            return results
+        for filename in self.target_files():
+            if clinix.is_compressed(filename): # lines can't be read back out of the middle of one
+                results.extend(self.grep_file(filename))
+                continue
+            try:
+                if self.use_mmap(filename):
+                    with self.mapped(filename) as buf:
+                        for linenum, start, stop, match in self.numbered_spans(buf):
+                            results.add_match(filename, linenum, start, stop, self.matched_pattern(match))
+                else:
+                    for match in self.line_spans(filename):
+                        results.add_match(filename, *match)
+            except IOError as e:
+                results.append(GrepError(filename, e.strerror))
+        return results
+
+    def line_spans(self, filename):
+        """
+        like grep_file, but yields the line number, start and end offsets (without the line break), and pattern 
+        of each match. The file is memory-mapped and split into lines the way grep_file reading it as text
+        does (see text_lines), and each line decoded (as strictly as that) to search it
 
-    def __str__(self):
+        raises IOError if the file can't be read
         """
-        Returns the output of this grep command
+
+        encoding = locale.getpreferredencoding(False) # what open() would have decoded the file with
+        with self.mapped(filename) as buf:
+            for linenum, (start, stop) in enumerate(text_lines(buf), 1):
+                self.stats.lines += 1
+                for line, pattern in self.grep_line(buf[start:stop].decode(encoding)):
+                    yield linenum, start, stop, pattern
+
+    def iter_lines(self):
+        """
+        Yields the output of this grep command
         matches are printed on their own line, possibly with some ifo depending on the optoins given
         errors are reported with the filename and the error
+        with quiet, nothing is output, grep just stops once something matches
+        """
+
+        if self.quiet:
+            for _ in self.eval():
+                pass
+            return
+        for arg in self.eval():
+            yield self.result_str(arg)
+
+    def iter_output(self):
+        """
+        with quiet, nothing at all is written, not even the newline of an empty output
         """
 
-        def singlestr(arg):
-            if isinstance(arg, GrepSuccess):
-                result = ''
-                if self.linenumber:
-                    result += str(arg.linenum) + ':'
-                result += arg.line
-                return result
-            elif isinstance(arg, GrepError):
-                return 'grep: ' + arg.file + ': ' + arg.reason
+        if self.quiet:
+            for _ in self.iter_lines():
+                pass
+            return
+        yield from super().iter_output()
+
+    def result_str(self, arg):
+        """
+        formats a single result of eval() as a line of output
+        """
+
+        if isinstance(arg, GrepSuccess):
+            result = ''
+            if self.linenumber:
+                result += str(arg.linenum) + ':'
+            result += arg.line
+            return result
+        elif isinstance(arg, GrepFile):
+            return arg.file
+        elif isinstance(arg, GrepCount):
+            if arg.file == '<stdin>':
+                return str(arg.count)
+            return arg.file + ':' + str(arg.count)
+        elif isinstance(arg, GrepError):
+            return 'grep: ' + arg.file + ': ' + arg.reason
+        else:
+            raise Exception("Don't know how to handle grep result " + arg.__class__.__name__)
+
+class GrepResults:
+    """
+    A compact, columnar list of the results of a grep, made by eval() with compact=True, for greps with very many matches
+
+    Rather than a GrepSuccess with its own copy of the filename and line, each match is just a few numbers 
+    in arrays: the id of its file (each filename is kept once, in files), its line number, and where the line 
+    is in the file. Lines are only read back out of their files (and decoded) when a match is looked at,
+    so the files shouldn't change in between. Matches whose line can't be read back (from stdin, or
+    compressed files) keep their line as text, and anything that isn't a match (like GrepError) is kept as is
+
+    Iterating over it or indexing it gives GrepSuccess records (and the others), just like eval() normally does
+    """
+
+    def __init__(self):
+        self.files = [] # each filename, once
+        self.file_ids = {} # filename to its index in files
+        self.patterns = [None] # each pattern that matched, once
+        self.pattern_ids = {None: 0}
+        self.file_column = array('I')
+        self.pattern_column = array('I')
+        self.linenums = array('Q')
+        self.starts = array('q') # -1 for results that are in self.others instead
+        self.stops = array('Q')
+        self.others = {} # index of each result that isn't a match read back from a file, to it (or its line)
+        self.encoding = locale.getpreferredencoding(False) # what open() would have decoded the files with
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intern(self, ids, values, value):
+        """
+        the id of value in values, adding it if it's new
+        """
+
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def add_match(self, filename, linenum, start, stop, pattern=None):
+        """
+        adds a match of the line at bytes start to stop of filename
+        """
+
+        self.file_column.append(self.intern(self.file_ids, self.files, filename))
+        self.pattern_column.append(self.intern(self.pattern_ids, self.patterns, pattern))
+        self.linenums.append(linenum)
+        self.starts.append(start)
+        self.stops.append(stop)
+
+    def append(self, result):
+        """
+        adds any result of eval(), keeping just the line of a GrepSuccess (its file and pattern are still interned)
+        """
+
+        if isinstance(result, GrepSuccess):
+            self.add_match(result.file, result.linenum, -1, 0, result.pattern)
+            result = result.line
+        else:
+            self.add_match(result.file, 0, -1, 0)
+        self.others[len(self) - 1] = result
+
+    def extend(self, results):
+        for result in results:
+            self.append(result)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('GrepResults index out of range')
+        if self.starts[i] >= 0:
+            with open(self.files[self.file_column[i]], 'rb') as f:
+                return self.result(i, f)
+        return self.result(i)
+
+    def __iter__(self):
+        """
+        yields each result in order, reading lines back from each file while it's open
+        """
+
+        f = None
+        try:
+            for i in range(len(self)):
+                if self.starts[i] >= 0 and (f is None or f.name != self.files[self.file_column[i]]):
+                    if f is not None:
+                        f.close()
+                    f = open(self.files[self.file_column[i]], 'rb')
+                yield self.result(i, f)
+        finally:
+            if f is not None:
+                f.close()
+
+    def result(self, i, f=None):
+        """
+        the i'th result, reading its line from f (its file, opened for reading bytes) if it's in there
+        """
+
+        other = self.others.get(i)
+        if other is not None and not isinstance(other, str):
+            return other
+        if other is None:
+            start = self.starts[i]
+            other = os.pread(f.fileno(), self.stops[i] - start, start).decode(self.encoding, 'replace')
+        return GrepSuccess(self.files[self.file_column[i]], other, self.linenums[i], 
+                           self.patterns[self.pattern_column[i]])
+
+def grep_file_job(pattern, options, filename):
+    """
+    greps a single file in a worker process of a parallel grep
+
+    returns all of the results for that file as a list, and the CommandStats of grepping it
+    """
+
+    command = GrepCommand(pattern, (), options)
+    return list(command.grep_one(filename)), command.stats
+
+class PatternSet:
+    """
+    A list of regexes searched for as if they were one alternation of them all, for patterns that
+    can't be put into one (see compile_pattern). Each is compiled on its own, and search() gives
+    the match of whichever starts first in the string, or of the first of them that starts there
+    """
+
+    def __init__(self, patterns, flags=0):
+        self.regexes = [re.compile(p, flags) for p in patterns]
+        self.flags = flags
+        # which pattern each regex is (the same pattern twice is compiled to the same regex, that's the first of them)
+        self.indexes = {}
+        for i, regex in enumerate(self.regexes):
+            self.indexes.setdefault(regex, i)
+
+    def search(self, string, pos=0):
+        """
+        the first match in string from pos of any of the regexes, or None
+        """
+
+        first = None
+        for regex in self.regexes:
+            match = regex.search(string, pos)
+            if match and (first is None or match.start() < first.start()):
+                first = match
+        return first
+
+    def index(self, match):
+        """
+        which pattern (by its index in the list) a match that search() gave is of
+        """
+
+        return self.indexes[match.re]
+
+def literal_trie_pattern(literals):
+    """
+    returns a regex matching any of the given literal strings, arranged as a trie 
+
+    e.g. ['cat', 'car', 'dog'] gives '(?:ca[tr]|dog)', so at each position in the text being searched,
+    each character is only looked at once however many literals there are
+    Where one literal is a prefix of another, the longer one is tried first
+    Only ASCII characters are put together into a character class like [tr], since the pattern is also
+    encoded to search bytes with (see mmap), where a class of multi-byte characters would be a class of their bytes
+    """
+
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[''] = {} # marks the end of a literal
+
+    def build(node):
+        chars = [] # characters that end a literal and aren't followed by anything
+        alternatives = []
+        for char, child in sorted(node.items()):
+            if char == '':
+                continue
+            if list(child) == [''] and char.isascii():
+                chars.append(re.escape(char))
             else:
-                raise Exception("Don't know how to handle grep result " + arg.__class__.__name__)
+                alternatives.append(re.escape(char) + build(child))
+        if len(chars) == 1:
+            alternatives.append(chars[0])
+        elif chars:
+            alternatives.append('[' + ''.join(chars) + ']')
+        if not alternatives:
+            return ''
+        pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        if '' in node:
+            pattern = '(?:' + pattern + ')?'
+        return pattern
+
+    return build(trie)
+
+def literal_text(pattern, flags=0):
+    """
+    the string the regex pattern matches, if all it matches is that one literal string
+    (like 'foo bar', 'a-b', or 'a\\.b'), otherwise None
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    if parsed.state.flags != sre_parse.parse('', flags).state.flags: # e.g. (?i) changes what it matches
+        return None
+    if any(op != sre_parse.LITERAL for op, _ in parsed):
+        return None
+    return ''.join(chr(arg) for _, arg in parsed)
+
+def regex_ops(parsed):
+    """
+    lazily yields every (op, argument) in a regex parsed by sre_parse, including the ones inside groups and repeats
+    """
+
+    for op, arg in parsed:
+        yield op, arg
+        yield from nested_ops(arg)
+
+def nested_ops(arg):
+    """
+    the (op, argument) pairs of any parsed regexes inside the argument of an op
+    """
+
+    if isinstance(arg, sre_parse.SubPattern):
+        yield from regex_ops(arg)
+    elif isinstance(arg, (tuple, list)):
+        for item in arg:
+            yield from nested_ops(item)
+
+def refers_back(pattern, flags=0):
+    """
+    whether the regex pattern refers back to a group of its own (like \\1 or (?(1)...)), which would refer
+    to another group once it's in an alternation with other patterns. False if it can't be parsed
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return False
+    return any(op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS) for op, _ in regex_ops(parsed))
+
+def compiles(pattern, flags=0):
+    """
+    whether the regex pattern compiles at all
+    """
+
+    try:
+        re.compile(pattern, flags)
+    except re.error:
+        return False
+    return True
+
+def looks_past_line(pattern, flags=0):
+    """
+    whether the regex pattern can match differently in a line on its own than in the middle of a whole file
+    (see CONTEXT_OPS), True if it can't be parsed
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return True
+    return any(op in CONTEXT_OPS or op == sre_parse.AT and arg in CONTEXT_ATS for op, arg in regex_ops(parsed))
+
+def text_lines(buf):
+    """
+    lazily yields the start and end offsets of each line in buf (bytes-like), without its line break,
+    split the way a file opened as text is (see clinix.LINE_BREAK)
+    """
+
+    pos = 0
+    for match in clinix.LINE_BREAK.finditer(buf):
+        yield pos, match.start()
+        pos = match.end()
+    if pos < len(buf):
+        yield pos, len(buf)
+
+def text_line_count(buf):
+    """
+    how many lines buf (bytes-like) has, split the way a file opened as text is (see clinix.LINE_BREAK)
+    """
 
-        return '\n'.join(singlestr(arg) for arg in self.eval())
+    if buf.find(b'\r') != -1:
+        return sum(1 for _ in text_lines(buf))
+    return clinix.count_newlines(buf, 0, len(buf)) + (buf[-1:] not in (b'', b'\n'))
 
-def grep(pattern, *args, **options):
+def grep(pattern=None, *args, **options):
     """
     searches the given files for the given pattern
 
     pattern is a regular expression interpretted by Python's re module
+    it may also be a list of them, and lines matching any of them are selected, in a single pass
+    over the input however many there are. Each GrepSuccess then says which pattern matched
 
     options is a dict of options to grep
     Valid options (with defaults):
@@ -130,6 +984,51 @@ def grep(pattern, *args, **options):
             if True, report the line numbers of matching lines as well
         v=False, invertmatch=False:
             if True, selects lines not matching pattern instead
+        f=None, patternfile=None:
+            if given, a file of patterns to use, one per line. The pattern argument 
+            (if there is one) is then taken as the first file to search instead
+        F=False, fixedstrings=False:
+            if True, patterns are literal strings rather than regular expressions
+        m=None, maxcount=None:
+            if given, stop reading a file after this many matching lines
+        l=False, fileswithmatches=False:
+            if True, only output the names of files with a match (as GrepFile), reading each only up to its first match
+        c=False, count=False:
+            if True, only output how many lines of each file match (as GrepCount)
+        follow=False:
+            if True, each run only searches the lines appended to the files since the last run, so it finds
+            only new matches (see poll() and watch() to run it over and over). Files are searched line by line,
+            without jobs, index, or the cache
+        q=False, quiet=False:
+            if True, output nothing, and stop everything at the first match. eval() then
+            has at most one match in it, so it says whether anything matched at all
+        compact=False:
+            if True, eval() returns a GrepResults, which keeps each match as a few numbers instead of a GrepSuccess,
+            and only reads a line back from its file when it's looked at. For greps with millions of matches
+        mmap=False:
+            if True, memory-map each file and search it all at once as bytes, which is much faster
+            on big files. Character classes then only know about ASCII. Ignored with invertmatch
+        jobs=1:
+            number of processes to grep files with. Output is in the same order either way
+        cache=False:
+            if True, only grep files again that have changed since the last run
+        r=False, recurse=False:
+            if True, grep every file under the directories given. Directories are listed on 
+            several threads, and files are grepped as they are found
+        include=(), exclude=(), maxdepth=None:
+            when recursing, only grep files matching the globs in include, skip files and 
+            directories matching the globs in exclude (e.g. exclude=['.git', 'node_modules']),
+            and don't go more than maxdepth directories down
+        index=None:
+            if given, the path of a trigram index (see trigram.TrigramIndex) to keep of the files grepped, 
+            and only the files that could have a match according to it are opened. The index is brought up 
+            to date for any file whose size or mtime has changed first, so the results are the same as without it
     """
 
+    patternfile = options.get('patternfile', None) or options.get('f', None)
+    if patternfile is not None:
+        if pattern is not None:
+            args = (pattern,) + args
+        with open(patternfile) as f:
+            pattern = [line.rstrip('\n') for line in f]
     return GrepCommand(pattern, args, options)
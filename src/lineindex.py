@@ -0,0 +1,218 @@
+# lineindex.py
+# an index of where each line of a file ends, for jumping straight to lines by number
+
+import bisect
+import clinix
+import itertools
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+CACHED_INDEXES = 64 # how many files' indexes line_index() keeps in memory at once
+TAIL_CHECK = 64 # how many bytes from the end of what was indexed are checked, to tell that a file was only appended to
+SIDECAR_HEADER = struct.Struct('<8sQQQQ') # magic, inode, size indexed, mtime_ns, and length of the tail check
+SIDECAR_MAGIC = b'CLXLIDX2' # (1 only split lines at '\n')
+
+cache = OrderedDict() # (device, inode) of each file to its LineIndex, least recently used first
+cache_lock = threading.Lock()
+
+class LineIndex:
+    """
+    The offsets of the end of each line of a file (just past its line break), as a compact array('Q')
+    Lines are split the way a file opened as text is, at '\n', '\r\n', or a lone '\r' (see clinix.LINE_BREAK)
+
+    Line n (from 1) of the file is bytes [ends[n - 2], ends[n - 1]) (from 0 for the first line), and if the
+    file doesn't end in a newline, its last line runs from ends[-1] to the end of the file. So where any line
+    starts and stops is known right away, without reading the file up to it
+
+    The index is built by scanning the file's bytes a block at a time. When the file has only been appended to
+    since (it is the same file, bigger, and the end of what was indexed hasn't changed), only the new tail is scanned
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ends = array('Q')
+        self.ino = None
+        self.size = 0 # how much of the file has been indexed
+        self.mtime_ns = None
+        self.tail = b'' # the last TAIL_CHECK bytes of what was indexed
+        self.saved = None # the (size, mtime_ns) of the index in its sidecar file, if it's been saved or loaded
+
+    def __len__(self):
+        """
+        how many lines the file had when it was last indexed
+        """
+
+        return len(self.ends) + (self.size > (self.ends[-1] if self.ends else 0))
+
+    def update(self):
+        """
+        brings the index up to date with the file, scanning only what was appended to it
+        if that is all that changed, or all of it otherwise. Returns self
+
+        raises IOError if the file can't be read
+        """
+
+        with open(self.filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if (st.st_ino, st.st_size, st.st_mtime_ns) == (self.ino, self.size, self.mtime_ns):
+                return self
+            # anything but the same file having grown, with the end of what was indexed still there, is a new file
+            if st.st_ino != self.ino or st.st_size <= self.size or not self.tail_matches(f):
+                self.ends = array('Q')
+                self.size = 0
+            self.scan(f, st.st_size)
+            self.ino = st.st_ino
+            self.mtime_ns = st.st_mtime_ns
+        return self
+
+    def tail_matches(self, f):
+        """
+        whether the end of what was indexed is still the same in f
+        """
+
+        return os.pread(f.fileno(), len(self.tail), self.size - len(self.tail)) == self.tail
+
+    def scan(self, f, size):
+        """
+        indexes f from self.size up to size, a block at a time
+        """
+
+        offset = self.size
+        if self.tail.endswith(b'\r') and offset < size and os.pread(f.fileno(), 1, offset) == b'\n':
+            # what was indexed ended in a '\r', which turns out to be the start of a '\r\n'
+            self.ends[-1] += 1
+            offset += 1
+        f.seek(offset)
+        while offset < size:
+            block = f.read(min(clinix.BLOCK_SIZE, size - offset))
+            if not block:
+                break
+            if block.endswith(b'\r') and len(block) > 1 and offset + len(block) < size:
+                # the '\r' could be the start of a '\r\n', so it's left for the next block
+                block = block[:-1]
+                f.seek(offset + len(block))
+            if b'\r' in block:
+                self.ends.extend(offset + match.end() for match in clinix.LINE_BREAK.finditer(block))
+            else:
+                # the end of each line is the end of the one before plus its length (and newline)
+                lines = block.split(b'\n')
+                lines.pop() # whatever is after the last newline isn't a whole line yet
+                ends = itertools.accumulate((len(line) + 1 for line in lines), initial=offset)
+                self.ends.extend(itertools.islice(ends, 1, None))
+            offset += len(block)
+        self.size = offset
+        self.tail = os.pread(f.fileno(), min(TAIL_CHECK, offset), offset - min(TAIL_CHECK, offset))
+
+    def line_span(self, first, last=None):
+        """
+        the byte offsets (start, stop) of lines first through last of the file (counting from 1,
+        and including last, which defaults to the last line), the newline after last included
+        """
+
+        first = max(first, 1)
+        last = len(self) if last is None else min(last, len(self))
+        if first > last:
+            return (0, 0)
+        start = self.ends[first - 2] if first > 1 else 0
+        stop = self.ends[last - 1] if last <= len(self.ends) else self.size
+        return (start, stop)
+
+    def line_number(self, offset):
+        """
+        the number (from 1) of the line the byte at offset is in
+        """
+
+        return bisect.bisect_right(self.ends, offset) + 1
+
+    def reversed_spans(self, first=1, last=None):
+        """
+        lazily yields the (start, stop) offsets of lines last through first, from last to first,
+        without the last byte of their line breaks (so a '\r\n' still leaves its '\r')
+        """
+
+        last = len(self) if last is None else min(last, len(self))
+        for n in range(last, max(first, 1) - 1, -1):
+            start, stop = self.line_span(n, n)
+            if n <= len(self.ends):
+                stop -= 1
+            yield (start, stop)
+
+    def save(self, path):
+        """
+        writes the index to the sidecar file path
+        """
+
+        with open(path, 'wb') as f:
+            f.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, self.ino, self.size, self.mtime_ns, len(self.tail)))
+            f.write(self.tail)
+            self.ends.tofile(f)
+        self.saved = (self.size, self.mtime_ns)
+
+    def load(self, path):
+        """
+        reads the index from the sidecar file path, if there is a valid one. Returns whether there was
+
+        it is loaded whatever state the file is in now, update() then works out what changed
+        """
+
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(SIDECAR_HEADER.size)
+                if len(header) != SIDECAR_HEADER.size:
+                    return False
+                magic, ino, size, mtime_ns, tail_length = SIDECAR_HEADER.unpack(header)
+                if magic != SIDECAR_MAGIC:
+                    return False
+                tail = f.read(tail_length)
+                ends = array('Q')
+                ends.frombytes(f.read())
+        except (OSError, ValueError):
+            return False
+        self.ends, self.ino, self.size, self.mtime_ns, self.tail = ends, ino, size, mtime_ns, tail
+        self.saved = (size, mtime_ns)
+        return True
+
+def sidecar_path(filename):
+    """
+    the sidecar file the line index of filename is saved in
+    """
+
+    return filename + '.lineidx'
+
+def line_index(filename, sidecar=False):
+    """
+    returns an up to date LineIndex of filename, reusing the one from last time if there is one
+
+    the last CACHED_INDEXES files' indexes are kept in memory, by the file's device and inode
+    if sidecar is True, the index is also loaded from (if it's not in memory) and saved to
+    a sidecar file next to the file (see sidecar_path), so it lasts between runs. It's saved
+    whenever the sidecar is missing or isn't of the index as it is now
+    raises IOError if the file can't be read
+    """
+
+    st = os.stat(filename)
+    key = (st.st_dev, st.st_ino)
+    with cache_lock:
+        index = cache.pop(key, None)
+    if index is None:
+        index = LineIndex(filename)
+        if sidecar:
+            index.load(sidecar_path(filename))
+    index.filename = filename
+    try:
+        index.update()
+    finally:
+        with cache_lock:
+            cache[key] = index
+            while len(cache) > CACHED_INDEXES:
+                cache.popitem(last=False)
+    path = sidecar_path(filename)
+    if sidecar and (index.saved != (index.size, index.mtime_ns) or not os.path.exists(path)):
+        try:
+            index.save(path)
+        except OSError:
+            pass # e.g. the directory isn't writable, the index just won't last
+    return index
@@ -3,6 +3,14 @@
 
 import clinix
 import os
+import stat
+import time
+from collections import namedtuple
+
+LsFile = namedtuple('LsFile', 'file size mtime')
+LsDirectory = namedtuple('LsDirectory', 'file entries')
+LsEntry = namedtuple('LsEntry', 'name isdir size mtime')
+LsError = namedtuple('LsError', 'file reason')
 
 class LsCommand(clinix.ClinixCommand):
     """
@@ -27,51 +35,85 @@ class LsCommand(clinix.ClinixCommand):
         parses the options given to ls
         """
 
-        pass
+        self.long = options.get('long', False) or options.get('l', False)
 
     def ls_one(self, arg):
         """
         Processes a single argument to ls
 
         arg can be either a file or directory
-        if it is a file, just list the file
+        if it is a file, just list the file, with the size and mtime from stat'ing it
         if it is a dir, list all the files and directories in it
+
+        returns LsFile, LsDirectory, or LsError
+        """
+
+        try:
+            st = os.stat(arg)
+            if not stat.S_ISDIR(st.st_mode):
+                return LsFile(arg, st.st_size, st.st_mtime)
+            with os.scandir(arg) as it:
+                return LsDirectory(arg, [self.ls_entry(entry) for entry in it])
+        except OSError as e:
+            return LsError(arg, e.strerror)
+
+    def ls_entry(self, entry):
         """
+        Makes an LsEntry out of an os.DirEntry from listing a directory
 
-        # TODO: use namedtuples
-        if os.path.isfile(arg):
-            return ('file', arg)
-        elif os.path.isdir:
-            return ('directory', arg, os.listdir(arg))
-        else:
-            raise Exception(arg + ': no such file or directory')
+        whether it is a directory comes from the listing itself, without stat'ing the entry
+        size and mtime are only filled in for long listings (and are None if the entry can't be stat'd)
+        """
+
+        size = None
+        mtime = None
+        if self.long:
+            try:
+                st = entry.stat()
+                size = st.st_size
+                mtime = st.st_mtime
+            except OSError:
+                pass
+        return LsEntry(entry.name, clinix.is_dir(entry), size, mtime)
 
     def eval(self):
         """
         Returns a Python representation of the output of this command
 
-        Returns a list of tuples about files and directories
+        Returns a list of LsFile, LsDirectory, and LsError
         """
         
         filenames = clinix.expand_files(self.filenames)
         return [self.ls_one(arg) for arg in filenames]
 
-    def __str__(self):
+    def iter_lines(self):
         """
-        Returns the output from this ls command
+        Yields the output from this ls command
 
         files are printed by their names
         diretcories are printed by their name and then
         everything within them 
+        long listings put the size and modification time before each name
         """
 
-        def singlestr(arg):
-            if arg[0] == 'file':
-                return arg[1]
-            elif arg[0] == 'directory':
-                return arg[1] + ':\n\t' + '\n\t'.join(arg[2])
-
-        return '\n'.join(singlestr(arg) for arg in self.eval())
+        def namestr(name, size, mtime):
+            if not self.long:
+                return name
+            if size is None:
+                return '{:>10} {:12} {}'.format('?', '?', name)
+            return '{:>10} {} {}'.format(size, time.strftime('%b %d %H:%M', time.localtime(mtime)), name)
+
+        for arg in self.eval():
+            if isinstance(arg, LsFile):
+                yield namestr(arg.file, arg.size, arg.mtime)
+            elif isinstance(arg, LsDirectory):
+                yield arg.file + ':'
+                for entry in arg.entries:
+                    yield '\t' + namestr(entry.name, entry.size, entry.mtime)
+            elif isinstance(arg, LsError):
+                yield 'ls: ' + arg.file + ': ' + arg.reason
+            else:
+                raise Exception("Don't know how to handle ls result " + arg.__class__.__name__)
 
 def ls(*args, **options):
     """
@@ -81,14 +123,18 @@ def ls(*args, **options):
     if args is empty, a sole argument '.' is assumed
 
     A list is returned, with elements as follows:
-        if an arg was a file, just the filename 
-        if an arg is a directory, a tuple of filename and list
-        of files/directories in that directory 
+        if an arg was a file, an LsFile of its name, size, and mtime
+        if an arg is a directory, an LsDirectory of its name and a list 
+        of LsEntry for the files/directories in that directory 
+        if an arg couldn't be listed, an LsError
+
+    Directories are listed with os.scandir, so whether each entry is a directory
+    is known without stat'ing it
 
     options is a dict of options to ls
     Valid options (with defaults):
-        
+        l=False, long=False:
+            also list the size and modification time of everything in a directory
     """
 
     return LsCommand(args, options)
-
@@ -0,0 +1,209 @@
+# sort.py
+# emulates the sort tool
+
+import clinix
+import concurrent.futures
+import contextlib
+import heapq
+import os
+import re
+import shutil
+import tempfile
+from collections import namedtuple
+
+SortError = namedtuple('SortError', 'file reason')
+
+SORT_BUFFER_SIZE = 64 << 20 # default memory budget for the lines sorted at once, past which they're sorted in runs
+LINE_OVERHEAD = 64 # roughly how many bytes of memory a line takes up on top of its characters
+RUN_ENCODING = 'utf-8' # what runs are written to their temp files in
+NUMBER = re.compile(r'\s*([-+]?(\d+\.?\d*|\.\d+))')
+
+class SortKey:
+    """
+    What lines are sorted by: a field of them (or the whole line), as a number or as a string
+
+    A class rather than a function so it can be sent to the processes sorting runs
+    """
+
+    def __init__(self, field=None, separator=None, numeric=False):
+        """
+        field is which field to sort by, counting from 1, or None for the whole line
+        fields are split by separator, or by runs of whitespace if it's None
+        """
+
+        self.field = field
+        self.separator = separator
+        self.numeric = numeric
+
+    def __call__(self, line):
+        if self.field is not None:
+            fields = line.split(self.separator)
+            line = fields[self.field - 1] if self.field <= len(fields) else ''
+        if self.numeric:
+            match = NUMBER.match(line)
+            return float(match.group(1)) if match else 0.0 # like sort -n, anything that isn't a number is 0
+        return line
+
+class SortCommand(clinix.LineCommand):
+    """
+    Class to represent a sort command
+    """
+
+    error = SortError
+
+    def parse_options(self, options):
+        """
+        parses the options given to sort
+        """
+
+        self.numeric = options.get('numeric', False) or options.get('n', False)
+        self.reverse = options.get('reverse', False) or options.get('r', False)
+        self.unique = options.get('unique', False) or options.get('u', False)
+        self.field = options.get('key', None) or options.get('k', None)
+        self.separator = options.get('separator', None) or options.get('t', None)
+        self.buffersize = options.get('buffersize', None) or options.get('S', None) or SORT_BUFFER_SIZE
+        self.tempdir = options.get('tempdir', None) or options.get('T', None)
+        self.jobs = options.get('jobs', 1)
+        if self.field is None and self.separator is None and not self.numeric:
+            self.key = None # sorting by the lines themselves is fastest without a key function
+        else:
+            self.key = SortKey(self.field, self.separator, self.numeric)
+
+    def eval(self):
+        """
+        returns a Python representation of the result of this command
+
+        for sort, lazily yields a SortError for each file that couldn't be read,
+        then all the lines of the files (or of stdin) in sorted order
+
+        Lines are read into runs of up to buffersize bytes (roughly, in memory). If all of them fit in one,
+        they're just sorted. Otherwise each full run is sorted (on one of jobs worker processes, if jobs
+        is more than 1) and written to a temp file, and then the runs are merged, reading a line
+        from each at a time, so only the last run and a buffer for each of the others are in memory
+        """
+
+        errors = []
+        runs = [] # the temp files each spilled run is in, as futures if they are being sorted by a pool
+        run = []
+        run_size = 0
+        tempdir = None
+        pool = None
+        stack = contextlib.ExitStack() # the runs' temp files, while they're being merged
+        try:
+            for chunk in self.input_chunks():
+                if isinstance(chunk, SortError):
+                    errors.append(chunk)
+                    continue
+                run.extend(chunk)
+                run_size += sum(map(len, chunk)) + LINE_OVERHEAD * len(chunk)
+                if run_size < self.buffersize:
+                    continue
+                if tempdir is None:
+                    tempdir = tempfile.mkdtemp(prefix='clinix-sort-', dir=self.tempdir)
+                    if self.jobs > 1:
+                        pool = concurrent.futures.ProcessPoolExecutor(self.jobs)
+                path = os.path.join(tempdir, 'run{}'.format(len(runs)))
+                if pool is None:
+                    sort_run(run, self.key, self.reverse, self.unique, path)
+                    runs.append(path)
+                else:
+                    runs.append(pool.submit(sort_run, run, self.key, self.reverse, self.unique, path))
+                    if len(runs) > self.jobs: # only so many runs are held in memory waiting to be sorted
+                        runs[-self.jobs - 1].result()
+                run = []
+                run_size = 0
+            yield from errors
+            run = sorted_lines(run, self.key, self.reverse, self.unique)
+            if not runs:
+                yield from run
+                return
+            runs = [r if isinstance(r, str) else r.result() for r in runs]
+            # newline='\n' so a '\r' in a line is kept, rather than being read back as a line break
+            files = [stack.enter_context(open(path, encoding=RUN_ENCODING, errors='surrogatepass', newline='\n',
+                                              buffering=clinix.OUTPUT_BUFFER_SIZE)) for path in runs]
+            lines = heapq.merge(*[(line.rstrip('\n') for line in f) for f in files], run,
+                                key=self.key, reverse=self.reverse)
+            if self.unique:
+                lines = unique_lines(lines, self.key)
+            yield from lines
+        finally:
+            stack.close()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            if tempdir is not None:
+                shutil.rmtree(tempdir, ignore_errors=True)
+
+    def iter_chunks(self):
+        """
+        lazily yields the output of sort in chunks (lists of lines)
+        """
+
+        lines = (arg if isinstance(arg, str) else 'sort: ' + arg.file + ': ' + arg.reason for arg in self.eval())
+        yield from clinix.batched(lines)
+
+def sorted_lines(lines, key, reverse, unique):
+    """
+    returns the list lines sorted (in place), with only the first of each run of lines with the same key if unique
+    """
+
+    lines.sort(key=key, reverse=reverse)
+    if unique:
+        lines = list(unique_lines(lines, key))
+    return lines
+
+def unique_lines(lines, key):
+    """
+    lazily yields the sorted lines, except for ones with the same key as the one before
+    """
+
+    last = object()
+    for line in lines:
+        k = line if key is None else key(line)
+        if k != last:
+            yield line
+        last = k
+
+def sort_run(lines, key, reverse, unique, path):
+    """
+    sorts a run of lines and writes it to the file path, a line at a time, returning path
+
+    module-level, so it can be run in a worker process
+    """
+
+    with open(path, 'w', encoding=RUN_ENCODING, errors='surrogatepass', newline='\n',
+              buffering=clinix.OUTPUT_BUFFER_SIZE) as f:
+        for line in sorted_lines(lines, key, reverse, unique):
+            f.write(line)
+            f.write('\n')
+    return path
+
+def sort(*args, **options):
+    """
+    outputs the lines of the passed files (or of stdin) in sorted order
+
+    inputs bigger than buffersize are sorted in runs that are written to temp files and merged,
+    so they don't have to fit in memory
+
+    options is a dict of options to sort
+    Valid options (with defaults):
+        k=None, key=None:
+            if given, sort by this field of each line (counting from 1) instead of the whole line
+        t=None, separator=None:
+            what separates the fields of a line, by default runs of whitespace
+        n=False, numeric=False:
+            sort by the number the line (or field) starts with, 0 if it doesn't
+        r=False, reverse=False:
+            sort in reverse order
+        u=False, unique=False:
+            only output the first of each group of lines that sort the same (have the same key)
+        S=SORT_BUFFER_SIZE, buffersize=SORT_BUFFER_SIZE:
+            roughly how many bytes of memory the lines sorted at once may take up
+        T=None, tempdir=None:
+            where to write the sorted runs of a big input, by default the system's temp directory
+        jobs=1:
+            if more than 1, the runs of a big input are sorted in a pool of this many worker processes
+            (while the next runs are being read)
+    lines that sort the same stay in the order they were given in
+    """
+
+    return SortCommand(args, options)
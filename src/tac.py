@@ -2,100 +2,84 @@
 # emulates the tac tool
 
 import clinix
-from collections import namedtuple
+import itertools
+import locale
+from collections import namedtuple, deque
 
 TacSuccess = namedtuple('TacSuccess', 'file contents')
 TacError = namedtuple('TacError', 'file reason')
 
-class TacCommand(clinix.ClinixCommand):
+class TacCommand(clinix.LineCommand):
     """
     Class to represent a tac command
     """
 
-    def __init__(self, args, options):
-        """
-        args is a list of files to output 
-        options is a dict of options to tac
-        """
-
-        super().__init__(options)
-        self.filenames = args
+    success = TacSuccess
+    error = TacError
 
     def parse_options(self, options):
         """
         parses the options given to tac
         """
 
-        pass
+        self.n = options.get('lines', None) or options.get('n', None)
 
-    def tac_one(self, filename):
+    def file_output(self, filename):
         """
-        tac's a single file
+        lazily yields the lines of a single file from last to first, without trailing newlines, in chunks
 
-        returns either TacSuccess or TacError
+        the file is read backwards from the end, so with n given only the tail of it is read
+        files that can't be seeked (like pipes or compressed files) are read forwards through tac_lines instead
+        raises IOError if the file can't be read
         """
 
-        try:
-            with open(filename) as f:
-                lines = f.read().splitlines()
-                lines = self.tac_lines(lines)
-                return TacSuccess(filename, '\n'.join(lines))
-        except IOError as e:
-            return TacError(filename, e.strerror)
+        encoding = locale.getpreferredencoding(False) # what open() would have decoded the file with
+        with self.open_file(filename, 'rb') as f:
+            if not f.seekable():
+                lines = (line.decode(encoding, 'replace').rstrip('\r\n') for line in f)
+                yield from clinix.batched(self.tac_lines(lines))
+                return
+            lines = clinix.reverse_lines(f)
+            if self.n is not None:
+                lines = itertools.islice(lines, self.n)
+            for chunk in clinix.batched(lines):
+                self.stats.lines += len(chunk)
+                text = b'\n'.join(chunk).decode(encoding, 'replace') # '\n' is never part of a longer character in locale encodings
+                chunk = text.split('\n')
+                if '\r' in text:
+                    chunk = [line[:-1] if line.endswith('\r') else line for line in chunk]
+                yield chunk
 
     def tac_lines(self, lines):
         """
         tac's the given lines
 
-        takes a list and returns a list
+        takes an iterable of lines and returns them in reverse order
+        (the last line can't be known until all of them have been read,
+        so this has to hold all of them, or the last n of them if n was given)
         """
 
-        return reversed(lines)
-
-    def tac_stdin(self):
-        """
-        tac's stdin
+        if self.n is not None:
+            return reversed(deque(lines, self.n))
+        return reversed(list(lines))
 
-        Currently always returns TacSuccess
+    def stdin_output(self):
         """
-
-        return TacSuccess('-', '\n'.join(self.tac_lines(self.read_stdin().splitlines())))
-
-    def eval(self):
+        tac's stdin, in chunks
         """
-        returns a Python representation of the result of this command
 
-        for tac, return the output of the given files, with the order of lines reversed
-        """
-
-        filenames = clinix.expand_files(self.filenames)
-        if filenames:
-            return [self.tac_one(f) for f in filenames]
-        else:
-            return [self.tac_stdin()]
-
-    def __str__(self):
-        """
-        Outputs the given files with their line orders reversed
-        """
-        
-        def singlestr(arg):
-            if isinstance(arg, TacSuccess):
-                return arg.contents
-            elif isinstance(arg, TacError):
-                return arg.file + ': ' + arg.reason
-            else:
-                raise Exception("Don't know how to handle tac result " + arg.__class__.__name__)
-
-        return '\n'.join(singlestr(arg) for arg in self.eval())
+        return clinix.batched(self.tac_lines(self.iter_stdin()))
 
 def tac(*args, **options):
     """
     outputs the contents of the passed files, with line order reversed
 
+    files are read backwards from the end a block at a time, rather than all at once
+
     options is a dict of options to tac
     Valid options (with defaults):
-
+        n=None, lines=None:
+            if given, only output the last n lines of each file (so only the end of each file is read)
     """
 
     return TacCommand(args, options)
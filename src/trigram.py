@@ -0,0 +1,235 @@
+# trigram.py
+# a persistent index of the trigrams in files, for narrowing down which files a grep has to open
+
+import clinix
+import os
+import re
+import sqlite3
+import threading
+
+try:
+    from re import _parser as sre_parse
+except ImportError: # before Python 3.11
+    import sre_parse
+
+MAX_QUERY_TRIGRAMS = 64 # at most this many trigrams of a literal are looked up, any of them rule files out just as well
+
+class TrigramIndex:
+    """
+    An on-disk index of which 3-byte sequences (trigrams) appear in which files, kept in an sqlite database
+
+    A regex can only match a line of a file if the file has every trigram of each literal string
+    the regex has to match, so looking those up narrows the files that could match down to a few.
+    Trigrams are indexed lowercased (ASCII only), so the same index works for case-insensitive searches
+
+    Files are indexed as they are asked about, and indexed again when their size or mtime changes
+    The index can be used from any thread (like the ones ado() and aeval() run on), one at a time
+    """
+
+    def __init__(self, path):
+        """
+        path is the file the index is kept in, created if it doesn't exist yet
+        """
+
+        self.path = path
+        self.connection = None
+        self.lock = threading.RLock() # held while the connection is used, since it's shared between threads
+
+    def connect(self):
+        """
+        returns the connection to the index's database, opening it (and making its tables) the first time
+        it isn't tied to the thread that opened it, but should only be used while holding self.lock
+        """
+
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    ino INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    trigram BLOB NOT NULL,
+                    file INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, file)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+            ''')
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def __getstate__(self):
+        # the connection (and lock) can't be sent to another process, it'll just open its own
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def update(self, filenames):
+        """
+        indexes each of filenames that is new or has changed since it was last indexed
+
+        returns a dict of each filename that could be looked at to its id in the index
+        (files that can't be stat'd or read are left out)
+        """
+
+        ids = {}
+        with self.lock, self.connect() as db:
+            for filename in filenames:
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                path = os.path.abspath(filename)
+                row = db.execute('SELECT id, ino, size, mtime_ns FROM files WHERE path = ?', (path,)).fetchone()
+                if row is not None and row[1:] == (st.st_ino, st.st_size, st.st_mtime_ns):
+                    ids[filename] = row[0]
+                    continue
+                try:
+                    trigrams = file_trigrams(filename)
+                except OSError:
+                    continue
+                if row is None:
+                    file_id = db.execute('INSERT INTO files (path, ino, size, mtime_ns) VALUES (?, ?, ?, ?)',
+                                         (path, st.st_ino, st.st_size, st.st_mtime_ns)).lastrowid
+                else:
+                    file_id = row[0]
+                    db.execute('UPDATE files SET ino = ?, size = ?, mtime_ns = ? WHERE id = ?',
+                               (st.st_ino, st.st_size, st.st_mtime_ns, file_id))
+                    db.execute('DELETE FROM postings WHERE file = ?', (file_id,))
+                db.executemany('INSERT INTO postings (trigram, file) VALUES (?, ?)',
+                               ((trigram, file_id) for trigram in trigrams))
+                ids[filename] = file_id
+        return ids
+
+    def files_with(self, trigrams):
+        """
+        returns the set of ids of files that have all of trigrams
+        """
+
+        trigrams = sorted(trigrams)[:MAX_QUERY_TRIGRAMS]
+        query = 'SELECT file FROM postings WHERE trigram IN ({}) GROUP BY file HAVING COUNT(*) = ?'.format(
+            ', '.join('?' * len(trigrams)))
+        with self.lock:
+            return {row[0] for row in self.connect().execute(query, trigrams + [len(trigrams)])}
+
+    def candidates(self, filenames, queries):
+        """
+        yields the filenames (after bringing them up to date in the index) that could have a match
+
+        queries is what a match needs, from pattern_query: a list of alternatives, any of which may match,
+        each a list of trigram sets that all have to be in a file. None means anything could match
+        Files that aren't in the index (like ones that can't be read) are always yielded,
+        so that whatever goes wrong with them is still reported
+        """
+
+        filenames = list(filenames)
+        ids = self.update(filenames)
+        if queries is None:
+            yield from filenames
+            return
+        matching = set()
+        for query in queries:
+            found = None
+            for trigrams in query:
+                files = self.files_with(trigrams)
+                found = files if found is None else found & files
+            matching |= found
+        for filename in filenames:
+            if filename not in ids or ids[filename] in matching:
+                yield filename
+
+def file_trigrams(filename):
+    """
+    returns the set of trigrams in a file, lowercased, reading it a block at a time
+    (compressed files are indexed by what they decompress to, since that's what grep searches)
+    """
+
+    trigrams = set()
+    carry = b'' # the last two bytes of the block before, for the trigrams across blocks
+    with clinix.open_input(filename, 'rb') as (f, _):
+        for block in iter(lambda: f.read(clinix.BLOCK_SIZE), b''):
+            block = carry + block.lower()
+            trigrams.update(map(block.__getitem__, map(slice, range(len(block) - 2), range(3, len(block) + 1))))
+            carry = block[-2:]
+    return trigrams
+
+def literal_trigrams(literal):
+    """
+    returns the set of (lowercased) trigrams of a literal string
+    """
+
+    data = literal.encode('utf-8').lower()
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+def required_literals(pattern, flags=0):
+    """
+    returns a list of alternatives, any of which a match of the regex pattern satisfies, each a list
+    of literal strings that all have to be in the text for a match. None if nothing is known
+
+    only runs of literal characters that every match has to contain are found, e.g.
+    'foo\\d+bar' needs 'foo' and 'bar', and 'foo|bar.z' is either 'foo' or 'bar'
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    ignorecase = bool(parsed.state.flags & re.IGNORECASE) # including any (?i) in the pattern
+    if len(parsed) == 1 and parsed[0][0] == sre_parse.BRANCH:
+        alternatives = []
+        for branch in parsed[0][1][1]:
+            literals = sequence_literals(branch, ignorecase)
+            if not literals:
+                return None
+            alternatives.append(literals)
+        return alternatives
+    literals = sequence_literals(parsed, ignorecase)
+    return [literals] if literals else None
+
+def sequence_literals(items, ignorecase):
+    """
+    the runs of literal characters that a parsed regex sequence has to match, as strings
+    """
+
+    literals = []
+    run = ''
+    for op, arg in items:
+        if op == sre_parse.LITERAL and not (ignorecase and arg > 127):
+            run += chr(arg) # case-insensitive non-ASCII characters could be in the file as another case
+            continue
+        literals.append(run)
+        run = ''
+        if op == sre_parse.SUBPATTERN:
+            literals.extend(sequence_literals(arg[-1], ignorecase))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+            literals.extend(sequence_literals(arg[2], ignorecase))
+    literals.append(run)
+    return [literal for literal in literals if len(literal.encode('utf-8')) >= 3]
+
+def pattern_query(patterns, flags=0, fixedstrings=False):
+    """
+    turns patterns (regexes, or literal strings if fixedstrings) into what TrigramIndex.candidates needs:
+    a list of alternatives, any of which a match satisfies, each a list of trigram sets that all have to be in it
+    None if any pattern could match anything
+    """
+
+    queries = []
+    for pattern in patterns:
+        if fixedstrings:
+            alternatives = [[pattern]] if len(pattern.encode('utf-8')) >= 3 else None
+        else:
+            alternatives = required_literals(pattern, flags)
+        if alternatives is None:
+            return None
+        for literals in alternatives:
+            queries.append([literal_trigrams(literal) for literal in literals])
+    return queries
@@ -0,0 +1,173 @@
+# uniq.py
+# emulates the uniq tool
+
+import clinix
+import itertools
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+UniqSuccess = namedtuple('UniqSuccess', 'line count')
+UniqError = namedtuple('UniqError', 'file reason')
+
+UNIQ_BUFFER_SIZE = 64 << 20 # default memory budget for the distinct lines counted at once in unsorted mode
+ENTRY_OVERHEAD = 112 # roughly how many bytes of memory a distinct line takes up on top of its characters
+PARTITIONS = 64 # how many partitions the distinct lines are split into when they don't fit in memory
+MAX_LEVEL = 4 # how many times a partition that still doesn't fit is split again, before just counting it anyway
+SPILL_ENCODING = 'utf-8' # what partitions are written to their temp files in
+
+class UniqCommand(clinix.LineCommand):
+    """
+    Class to represent a uniq command
+    """
+
+    error = UniqError
+
+    def parse_options(self, options):
+        """
+        parses the options given to uniq
+        """
+
+        self.count = options.get('count', False) or options.get('c', False)
+        self.repeated = options.get('repeated', False) or options.get('d', False)
+        self.unique = options.get('unique', False) or options.get('u', False)
+        self.unsorted = options.get('unsorted', False)
+        self.buffersize = options.get('buffersize', None) or options.get('S', None) or UNIQ_BUFFER_SIZE
+        self.tempdir = options.get('tempdir', None) or options.get('T', None)
+
+    def eval(self):
+        """
+        returns a Python representation of the result of this command
+
+        for uniq, lazily yields a UniqSuccess of each distinct line and how many times it was seen in a row
+        (or anywhere, if unsorted), only the ones seen more than once with repeated, or just once with unique,
+        and a UniqError for each file that couldn't be read
+        """
+
+        errors = []
+        def lines():
+            for chunk in self.input_chunks():
+                if isinstance(chunk, UniqError):
+                    errors.append(chunk)
+                else:
+                    yield from chunk
+
+        if self.unsorted:
+            counts = self.aggregate((line, 1) for line in lines())
+        else:
+            counts = ((line, sum(1 for _ in group)) for line, group in itertools.groupby(lines()))
+        for line, count in counts:
+            if self.repeated and count < 2 or self.unique and count > 1:
+                continue
+            yield UniqSuccess(line, count)
+        yield from errors
+
+    def aggregate(self, counts, level=0):
+        """
+        lazily yields each distinct line of counts, pairs of a line and how many times it was seen,
+        and how many times it was seen in all
+
+        Lines are counted in a dict until the distinct ones take up about buffersize bytes. If they never do,
+        they come out in the order they were first seen. Otherwise, what has been counted so far is spilled
+        to PARTITIONS temp files, split up by the hash of each line, and counting starts over. At the end,
+        each partition is counted on its own (split again, by a different hash, if it still doesn't fit),
+        so only about buffersize bytes of distinct lines are ever in memory at once
+        """
+
+        totals = {}
+        size = 0
+        tempdir = None
+        partitions = None
+        try:
+            for line, count in counts:
+                if line in totals:
+                    totals[line] += count
+                    continue
+                totals[line] = count
+                size += len(line) + ENTRY_OVERHEAD
+                if size >= self.buffersize and level < MAX_LEVEL:
+                    if partitions is None:
+                        tempdir = tempfile.mkdtemp(prefix='clinix-uniq-', dir=self.tempdir)
+                        # newline='\n' so a '\r' in a line is kept, rather than being read back as a line break
+                        partitions = [open(os.path.join(tempdir, str(i)), 'w+', encoding=SPILL_ENCODING,
+                                           errors='surrogatepass', newline='\n',
+                                           buffering=clinix.OUTPUT_BUFFER_SIZE)
+                                      for i in range(PARTITIONS)]
+                    spill(totals, partitions, level)
+                    totals = {}
+                    size = 0
+            if partitions is None:
+                yield from totals.items()
+                return
+            spill(totals, partitions, level)
+            totals = None
+            for partition in partitions:
+                partition.seek(0)
+                yield from self.aggregate(read_counts(partition), level + 1)
+                partition.close()
+        finally:
+            if partitions is not None:
+                for partition in partitions:
+                    partition.close()
+                shutil.rmtree(tempdir, ignore_errors=True)
+
+    def iter_chunks(self):
+        """
+        lazily yields the output of uniq in chunks (lists of lines)
+        each line is output once, after its count if count was given
+        """
+
+        def singlestr(arg):
+            if isinstance(arg, UniqSuccess):
+                if self.count:
+                    return str(arg.count).rjust(7) + ' ' + arg.line
+                return arg.line
+            elif isinstance(arg, UniqError):
+                return 'uniq: ' + arg.file + ': ' + arg.reason
+            else:
+                raise Exception("Don't know how to handle uniq result " + arg.__class__.__name__)
+
+        yield from clinix.batched(map(singlestr, self.eval()))
+
+def spill(totals, partitions, level):
+    """
+    writes each line and count in totals to one of partitions (text files), picked by the hash
+    of the line and level, so each level splits lines up differently
+    """
+
+    for line, count in totals.items():
+        partitions[hash((level, line)) % len(partitions)].write(str(count) + '\t' + line + '\n')
+
+def read_counts(partition):
+    """
+    lazily yields the pairs of a line and its count spilled to partition
+    """
+
+    for entry in partition:
+        count, line = entry[:-1].split('\t', 1)
+        yield line, int(count)
+
+def uniq(*args, **options):
+    """
+    outputs the lines of the passed files (or of stdin), but only once for each run of the same line
+
+    options is a dict of options to uniq
+    Valid options (with defaults):
+        c=False, count=False:
+            output how many times each line was seen before it
+        d=False, repeated=False:
+            only output lines that were seen more than once
+        u=False, unique=False:
+            only output lines that were only seen once
+        unsorted=False:
+            if True, count each distinct line wherever it is, not just runs of it, like sort | uniq
+            but without sorting: lines are counted in a hash table, which is split up and spilled to
+            temp files if the distinct lines take up more than buffersize
+        S=UNIQ_BUFFER_SIZE, buffersize=UNIQ_BUFFER_SIZE:
+            roughly how many bytes of memory the distinct lines counted at once may take up, with unsorted
+        T=None, tempdir=None:
+            where to spill the counts to, by default the system's temp directory
+    """
+
+    return UniqCommand(args, options)
@@ -2,11 +2,20 @@
 # emulates the wc program
 
 import clinix
+import codecs
+import locale
 from collections import namedtuple
 
-WcSuccess = namedtuple('WcSuccess', 'file lines words bytes')
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+WcSuccess = namedtuple('WcSuccess', 'file lines words bytes chars')
 WcError = namedtuple('WcError', 'file reason')
 
+NUMPY_BLOCK_SIZE = 16 << 20 # size of the blocks counted with numpy, big so its per-call overhead is spread thin
+
 class WcCommand(clinix.ClinixCommand):
     """
     Class to represent a wc command
@@ -20,6 +29,7 @@ class WcCommand(clinix.ClinixCommand):
 
         super().__init__(options)
         self.filenames = args
+        self.totals = {} # filename to its WcSuccess so far, in follow mode
 
     def parse_options(self, options):
         """
@@ -29,59 +39,185 @@ class WcCommand(clinix.ClinixCommand):
         self.count_lines = options.get('lines', False) or options.get('l', False)
         self.count_words = options.get('words', False) or options.get('w', False)
         self.count_bytes = options.get('bytes', False) or options.get('c', False)
+        self.count_chars = options.get('chars', False) or options.get('m', False)
+        self.numpy = options.get('numpy', False)
+        if self.numpy and numpy is None:
+            raise Exception('wc: numpy=True needs numpy, which is not installed')
 
         # by default, count lines, words, and bytes, overridden if something specific is passed
-        if not any((self.count_lines, self.count_words, self.count_bytes)):
+        if not any((self.count_lines, self.count_words, self.count_bytes, self.count_chars)):
             self.count_lines = True
             self.count_words = True
             self.count_bytes = True
 
+    def wc_file(self, filename):
+        """
+        counts for a single file, from the cache if it's turned on and the file hasn't changed
+        or in follow mode, by adding what was appended to it since the last run to the counts from then
+        """
+
+        if self.follow:
+            return self.wc_followed(filename)
+        if self.cache is None:
+            return self.wc_one(filename)
+        return self.cached(filename, self.wc_one)
+
     def wc_one(self, filename):
         """
-        counts for a single file
+        counts for a single file, reading it a block at a time
+
+        returns either WcSuccess or WcError
+        """
+
+        try:
+            with self.open_file(filename, 'rb') as f:
+                if self.numpy:
+                    buf = bytearray(NUMPY_BLOCK_SIZE) # read into over and over, rather than a new block each time
+                    view = memoryview(buf)
+                    blocks = (view[:n] for n in iter(lambda: f.readinto(buf), 0))
+                    result = WcSuccess(filename, *self.wc_blocks_numpy(blocks))
+                else:
+                    blocks = iter(lambda: f.read(clinix.BLOCK_SIZE), b'')
+                    result = WcSuccess(filename, *self.wc_blocks(blocks))
+                self.stats.lines += result.lines
+                return result
+        except IOError as e:
+            return WcError(filename, e.strerror)
+
+    def wc_followed(self, filename):
+        """
+        counts for a single file in follow mode, only reading the lines appended to it since the last run
+        and adding their counts to the ones for the file so far. Those start over if the file was rotated or truncated
 
+        a last line without a newline isn't counted until it has one (see clinix.appended_blocks)
         returns either WcSuccess or WcError
         """
 
         try:
-            with open(filename) as f:
-                n_lines, n_words, n_bytes = self.wc_text(f.read())
-                return WcSuccess(filename, n_lines, n_words, n_bytes)
+            with self.open_file(filename, 'rb') as f:
+                position = self.follow_start(filename, f)
+                counts = self.wc_blocks(clinix.appended_blocks(f, position.offset))
+                self.stats.lines += counts[0]
         except IOError as e:
             return WcError(filename, e.strerror)
+        before = self.totals.get(filename) if position.offset else None
+        if before is not None:
+            counts = [a + b for a, b in zip(before[1:], counts)]
+        result = self.totals[filename] = WcSuccess(filename, *counts)
+        self.positions[filename] = position._replace(offset=result.bytes, lines=result.lines)
+        return result
 
-    def wc_text(self, text):
+    def wc_blocks(self, blocks):
         """
-        Counts the lines, words, and bytes of a string
+        Counts the lines, words, bytes, and characters of an iterable of blocks of bytes
+
+        Only one block is looked at at a time. A word split across two blocks is 
+        only counted once, and a last line with no newline at the end is still counted
+        characters are counted by decoding the blocks the way open() would, but only if they were
+        asked for (chars is 0 otherwise), since decoding takes longer than all the rest
+        """
+
+        decoder = self.chars_decoder()
+        n_lines = 0
+        n_words = 0
+        n_bytes = 0
+        n_chars = 0
+        in_word = False # whether the last block ended in the middle of a word
+        last_byte = b''
+        for block in blocks:
+            n_bytes += len(block)
+            n_lines += block.count(b'\n')
+            n_words += len(block.split())
+            if in_word and not block[:1].isspace():
+                n_words -= 1 # the first word of this block was already counted in the last one
+            in_word = not block[-1:].isspace()
+            if decoder is not None:
+                n_chars += len(decoder.decode(block))
+            last_byte = block[-1:]
+        if decoder is not None:
+            n_chars += len(decoder.decode(b'', True))
+        if last_byte and last_byte != b'\n':
+            n_lines += 1
+        return n_lines, n_words, n_bytes, n_chars
+
+    def wc_blocks_numpy(self, blocks):
         """
+        Like wc_blocks, but counts each block (any bytes-like object) with numpy, as an array of bytes,
+        so nothing is made per line or word: the counts are vectorized comparisons over the whole block
 
-        n_lines = len(text.splitlines())
-        n_words = len(text.split())
-        n_bytes = len(text)
-        return n_lines, n_words, n_bytes
+        Words are counted as the places whitespace is followed by something else, with whether the block
+        before ended in whitespace carried over to the first byte of the next. Characters are still counted
+        by decoding the blocks like wc_blocks does (and only if asked for), so they come out the same for invalid text too
+        """
+
+        decoder = self.chars_decoder()
+        n_lines = 0
+        n_words = 0
+        n_bytes = 0
+        n_chars = 0
+        space_before = True # whether the byte before this block was whitespace (or it's the start)
+        last_byte = b''
+        for block in blocks:
+            data = numpy.frombuffer(block, dtype=numpy.uint8)
+            if not len(data):
+                continue
+            # the whitespace bytes.split() splits on: ' ', and '\t' through '\r' (9 to 13, which wrap around
+            # to 0 to 4 when 9 is taken away, while everything below 9 wraps around to above 246)
+            space = (data == ord(' ')) | (numpy.subtract(data, 9, dtype=numpy.uint8) <= 4)
+            n_bytes += len(data)
+            n_lines += int(numpy.count_nonzero(data == ord('\n')))
+            # True > False just where whitespace is followed by something that isn't, i.e. a word starts
+            n_words += int(numpy.count_nonzero(space[:-1] > space[1:])) + (space_before and not space[0])
+            space_before = bool(space[-1])
+            if decoder is not None:
+                n_chars += len(decoder.decode(block))
+            last_byte = bytes(block[-1:])
+        if decoder is not None:
+            n_chars += len(decoder.decode(b'', True))
+        if last_byte and last_byte != b'\n':
+            n_lines += 1
+        return n_lines, n_words, n_bytes, n_chars
+
+    def chars_decoder(self):
+        """
+        an incremental decoder that decodes bytes the way open() would, to count characters with,
+        or None if characters aren't being counted
+        """
+
+        if not self.count_chars:
+            return None
+        return codecs.getincrementaldecoder(locale.getpreferredencoding(False))('replace')
 
     def wc_stdin(self):
         """
-        Reads stdin and returns the lines, words, and bytes
+        Reads stdin a line at a time and returns the lines, words, bytes, and characters
         """
 
-        return WcSuccess('', *self.wc_text(self.read_stdin()))
+        encoding = locale.getpreferredencoding(False)
+        blocks = ((line + '\n').encode(encoding, 'replace') for line in self.iter_stdin())
+        n_lines, n_words, n_bytes, n_chars = self.wc_blocks(blocks)
+        if n_bytes: # the lines are joined by newlines, so there's one less newline than lines
+            n_bytes -= 1
+            n_chars -= bool(n_chars)
+        return WcSuccess('', n_lines, n_words, n_bytes, n_chars)
 
     def total(self, results):
         """
-        Totals up the lines, words, and bytes from a list of 
+        Totals up the lines, words, bytes, and characters from a list of 
         results
         """
 
         total_lines = 0
         total_words = 0
         total_bytes = 0
+        total_chars = 0
         for result in results:
             if isinstance(result, WcSuccess):
                 total_lines += result.lines
                 total_words += result.words
                 total_bytes += result.bytes
-        return WcSuccess('total', total_lines, total_words, total_bytes)
+                total_chars += result.chars
+        return WcSuccess('total', total_lines, total_words, total_bytes, total_chars)
 
     def eval(self):
         """
@@ -90,13 +226,13 @@ class WcCommand(clinix.ClinixCommand):
 
         filenames = list(clinix.expand_files(self.filenames))
         if filenames:
-            return [self.wc_one(f) for f in filenames]
+            return [self.wc_file(f) for f in filenames]
         else:
             return [self.wc_stdin()]
     
-    def __str__(self):
+    def iter_lines(self):
         """
-        Outputs each of the totals and filenames
+        Outputs each of the totals and filenames, a file at a time
 
         If more than one file given, output total as well
         """
@@ -104,25 +240,56 @@ class WcCommand(clinix.ClinixCommand):
         # TODO: format vertically aligned
         def singlestr(arg):
             if isinstance(arg, WcSuccess):
-                return '{} {} {} {}'.format(
+                counts = [
                     arg.lines if self.count_lines else '',
                     arg.words if self.count_words else '',
                     arg.bytes if self.count_bytes else '',
-                    arg.file
-                )
+                ]
+                if self.count_chars:
+                    counts.insert(2, arg.chars) # like wc, characters come before bytes
+                return ' '.join(str(count) for count in counts + [arg.file])
             elif isinstance(arg, WcError):
                 return arg.file + ': ' + arg.reason
             else:
                 raise Exception("Don't know how to handle wc result " + arg.__class__.__name__)
 
-        results = self.eval()
-        if len(results) != 1:
-            results.append(self.total(results))
-        return '\n'.join(singlestr(arg) for arg in results)
+        filenames = list(clinix.expand_files(self.filenames))
+        if filenames:
+            results = []
+            for filename in filenames:
+                result = self.wc_file(filename)
+                results.append(result)
+                yield singlestr(result)
+            if len(results) != 1:
+                yield singlestr(self.total(results))
+        else:
+            yield singlestr(self.wc_stdin())
 
 def wc(*args, **options):
     """
     counts the number of lines, words, and bytes in the given files
+
+    files are read a block at a time, so they can be any size
+
+    options is a dict of options to wc
+    Valid options (with defaults):
+        l=False, lines=False:
+            count lines
+        w=False, words=False:
+            count words
+        c=False, bytes=False:
+            count bytes
+        m=False, chars=False:
+            count characters, as decoded from the file
+        cache=False:
+            if True, only count files again that have changed since the last run
+        numpy=False:
+            if True, count files with numpy, a big block at a time (see wc_blocks_numpy), which is
+            several times faster. Needs numpy, which is optional: without it, files are counted in plain Python
+        follow=False:
+            if True, each run only reads what was appended to the files since the last run, adding it
+            to the counts from then (see poll() and watch() to run it over and over)
+    if none of these are given, lines, words, and bytes are counted
     """
 
     return WcCommand(args, options)
@@ -0,0 +1,98 @@
+# test_decompress.py
+# checks that compressed files are found by their magic and decompressed right, on one thread or several
+
+import bz2
+import errno
+import gzip
+import lzma
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import clinix
+
+COMPRESS = {'gzip': gzip.compress, 'bz2': bz2.compress, 'xz': lzma.compress}
+
+def lines(n, start=0):
+    return b''.join(b'line %d of a compressed file\n' % i for i in range(start, start + n))
+
+def read(path):
+    with clinix.open_input(str(path), 'rb') as (f, _):
+        return f.read()
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """
+    makes gzip files of a few KB big enough to be decompressed on several threads, in small blocks
+    """
+
+    monkeypatch.setattr(clinix, 'DECOMPRESS_THREADS', 3)
+    monkeypatch.setattr(clinix, 'GZIP_CHUNK_SIZE', 4096)
+    monkeypatch.setattr(clinix, 'GZIP_PIECE_SIZE', 512)
+    monkeypatch.setattr(clinix, 'BLOCK_SIZE', 4096)
+    monkeypatch.setattr(clinix, 'DECOMPRESS_AHEAD', 2)
+
+@pytest.mark.parametrize('kind', COMPRESS)
+def test_streams_one_after_another(tmp_path, kind):
+    path = tmp_path / 'f'
+    path.write_bytes(b''.join(COMPRESS[kind](lines(1000, i)) for i in range(0, 5000, 1000)))
+    assert read(path) == lines(5000)
+
+@pytest.mark.parametrize('kind', COMPRESS)
+def test_truncated_stream_is_an_error(tmp_path, kind):
+    path = tmp_path / 'f'
+    data = COMPRESS[kind](lines(1000))
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(IOError) as e:
+        read(path)
+    assert e.value.errno == errno.EIO
+    assert e.value.strerror.startswith('invalid ' + kind + ' data')
+
+def test_text_starting_like_bz2_is_not_bz2(tmp_path):
+    path = tmp_path / 'f'
+    path.write_bytes(b'BZh is how a bz2 file starts\n')
+    assert read(path) == b'BZh is how a bz2 file starts\n'
+    assert not clinix.is_compressed(str(path))
+
+def test_empty_bz2_is_bz2(tmp_path):
+    path = tmp_path / 'f'
+    path.write_bytes(bz2.compress(b''))
+    assert clinix.is_compressed(str(path))
+    assert read(path) == b''
+
+def test_parallel_many_members(tmp_path, parallel):
+    path = tmp_path / 'f.gz'
+    path.write_bytes(b''.join(gzip.compress(lines(100, i)) for i in range(0, 10000, 100)))
+    with open(path, 'rb') as f:
+        blocks = list(clinix.decompressed_blocks(f, 'gzip'))
+    assert b''.join(blocks) == lines(10000)
+    assert max(map(len, blocks)) <= clinix.BLOCK_SIZE
+
+def test_parallel_falls_back_for_one_big_member(tmp_path, parallel):
+    path = tmp_path / 'f.gz'
+    path.write_bytes(gzip.compress(lines(10000)))
+    assert read(path) == lines(10000)
+
+def test_parallel_falls_back_at_fake_magic(tmp_path, parallel):
+    # stored uncompressed, what looks like a member header in the data is in the file itself
+    data = b''.join(lines(50, i) + b'\x1f\x8b\x08 is the gzip magic\n' for i in range(0, 5000, 50))
+    path = tmp_path / 'f.gz'
+    path.write_bytes(gzip.compress(lines(300)) + gzip.compress(data, compresslevel=0) + gzip.compress(lines(300)))
+    assert read(path) == lines(300) + data + lines(300)
+
+def test_parallel_truncated(tmp_path, parallel):
+    path = tmp_path / 'f.gz'
+    data = b''.join(gzip.compress(lines(100, i)) for i in range(0, 10000, 100))
+    path.write_bytes(data[:-10])
+    with pytest.raises(IOError) as e:
+        read(path)
+    assert e.value.errno == errno.EIO
+
+def test_parallel_stops_when_closed_early(tmp_path, parallel):
+    path = tmp_path / 'f.gz'
+    path.write_bytes(b''.join(gzip.compress(lines(100, i)) for i in range(0, 10000, 100)))
+    with clinix.open_input(str(path), 'rb') as (f, _):
+        assert f.read(10) == lines(1)[:10]
@@ -0,0 +1,97 @@
+# test_follow.py
+# checks that follow mode only reads what was appended to a file, and starts over when it's rotated or truncated
+
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import clinix
+from grep import grep
+from wc import wc
+
+def append(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+
+def rotate(path, data):
+    """
+    moves path aside, and puts a new file with data in its place (so it's a different inode, like logrotate does)
+    """
+
+    os.replace(path, str(path) + '.1')
+    new = str(path) + '.new'
+    with open(new, 'wb') as f:
+        f.write(data)
+    os.replace(new, path)
+
+def test_appended_blocks_leaves_out_a_partial_last_line():
+    f = io.BytesIO(b'one\ntwo\nthr')
+    assert list(clinix.appended_blocks(f, 0)) == [b'one\ntwo\n']
+    f = io.BytesIO(b'one\ntwo\nthree\n')
+    assert list(clinix.appended_blocks(f, 4)) == [b'two\nthree\n']
+    assert list(clinix.appended_blocks(io.BytesIO(b'no newline'), 0)) == []
+
+def test_appended_blocks_across_blocks(monkeypatch):
+    monkeypatch.setattr(clinix, 'BLOCK_SIZE', 3)
+    data = b'one\ntwo\nthree\nfo'
+    assert b''.join(clinix.appended_blocks(io.BytesIO(data), 0)) == b'one\ntwo\nthree\n'
+
+def test_follow_start(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'one\ntwo\n')
+    command = wc(str(path), follow=True)
+    with open(path, 'rb') as f:
+        ino = os.fstat(f.fileno()).st_ino
+        assert command.follow_start(str(path), f) == clinix.FollowPosition(ino, 0, 0)
+        command.positions[str(path)] = clinix.FollowPosition(ino, 8, 2)
+        assert command.follow_start(str(path), f) == clinix.FollowPosition(ino, 8, 2)
+    path.write_bytes(b'one\n') # truncated
+    with open(path, 'rb') as f:
+        assert command.follow_start(str(path), f) == clinix.FollowPosition(ino, 0, 0)
+    path.write_bytes(b'one\ntwo\n')
+    rotate(path, b'one\ntwo\nthree\n')
+    with open(path, 'rb') as f:
+        new_ino = os.fstat(f.fileno()).st_ino
+        assert new_ino != ino
+        assert command.follow_start(str(path), f) == clinix.FollowPosition(new_ino, 0, 0)
+
+def test_grep_follow(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'err one\nok\n')
+    command = grep('err', str(path), n=True, follow=True)
+    assert [(r.line, r.linenum) for r in command.eval()] == [('err one', 1)]
+    assert list(command.eval()) == []
+    append(path, b'ok\nerr two\nerr thr')
+    assert [(r.line, r.linenum) for r in command.eval()] == [('err two', 4)]
+    append(path, b'ee\n')
+    assert [(r.line, r.linenum) for r in command.eval()] == [('err three', 5)]
+    path.write_bytes(b'err after truncating\n')
+    assert [(r.line, r.linenum) for r in command.eval()] == [('err after truncating', 1)]
+    rotate(path, b'ok\nerr after rotating\n')
+    assert [(r.line, r.linenum) for r in command.eval()] == [('err after rotating', 2)]
+
+def test_grep_follow_count(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'err\nok\n')
+    command = grep('err', str(path), c=True, follow=True)
+    assert [r.count for r in command.eval()] == [1]
+    append(path, b'err\nerr\n')
+    assert [r.count for r in command.eval()] == [2]
+
+def test_wc_follow(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'one two\n')
+    command = wc(str(path), follow=True)
+    counts = lambda: [(r.lines, r.words, r.bytes) for r in command.eval()]
+    assert counts() == [(1, 2, 8)]
+    assert counts() == [(1, 2, 8)]
+    append(path, b'three\nfour fi')
+    assert counts() == [(2, 3, 14)]
+    append(path, b've\n')
+    assert counts() == [(3, 5, 24)]
+    path.write_bytes(b'six\n')
+    assert counts() == [(1, 1, 4)]
+    rotate(path, b'seven eight\nnine\n')
+    assert counts() == [(2, 3, 17)]
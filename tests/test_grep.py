@@ -0,0 +1,78 @@
+# test_grep.py
+# checks that grep's mmap engine finds the same lines as searching line by line
+
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from grep import grep
+
+CONTENTS = {
+    'lf': b'xa\n\nb c\nfoo bar\n',
+    'crlf': b'xa\r\n\r\nb c\r\nfoo bar\r\n',
+    'no final newline': b'xa\n\nb c\nfoo bar',
+    'crlf no final newline': b'xa\r\n\r\nb c\r\nfoo bar',
+    'empty': b'',
+    'one newline': b'\n',
+    'utf-8': 'ça va\ncé\ncà\n'.encode('utf-8'),
+    'lone cr': b'x\ry\nz b\n',
+    'lone cr in a line': b'foo\rbar\n',
+    'lone cr at the end': b'foo\nbar\r',
+    'errors': b'err one\nerr two\nerr\n',
+}
+
+PATTERNS = ['^$', '.$', 'a$', r'\s', '[^a]', '[^a]$', '^b', 'o+', r'\w+ \w+$', ['xa', 'bar'], ['^$', 'b'], ['cé', 'cè'], ['foo bar', 'a\\.b'],
+            'b', '^bar', 'foo$', r'\Aerr', r'err\Z', r'(?<!\n)err', r'(?<=\n)err', r'r(?!\n)', r'o(?=\n)']
+
+@pytest.mark.parametrize('pattern', PATTERNS, ids=repr)
+@pytest.mark.parametrize('name', CONTENTS)
+def test_mmap_matches_line_mode(tmp_path, name, pattern):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(CONTENTS[name])
+    for options in ({}, {'c': True}, {'l': True}, {'m': 1}):
+        line_mode = list(grep(pattern, str(path), n=True, **options).eval())
+        mmap_mode = list(grep(pattern, str(path), n=True, mmap=True, **options).eval())
+        assert mmap_mode == line_mode, options
+
+def test_empty_pattern_list_matches_nothing(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(CONTENTS['lf'])
+    assert list(grep([], str(path)).eval()) == []
+    assert list(grep([], str(path), mmap=True).eval()) == []
+    assert len(list(grep([], str(path), v=True).eval())) == 4
+
+# lists of patterns that are each fine, but can't be put into one alternation together
+UNCOMBINABLE = {
+    'same group name': ['(?P<x>a)', '(?P<x>b)'],
+    'global flags': ['(?i)A', 'b'],
+    'numbered backreference': [r'(o)\1', 'a'],
+    'conditional group': [r'(f)?(?(1)oo|ba)', 'xa'],
+}
+
+@pytest.mark.parametrize('patterns', UNCOMBINABLE.values(), ids=list(UNCOMBINABLE))
+def test_uncombinable_patterns_match_like_each_on_its_own(tmp_path, patterns):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'xa\nb c\nfoo bar\nbaz\nABC\n')
+    lines = [line.rstrip('\n') for line in open(path)]
+    # like an alternation, the pattern that matched is the one whose match starts first, or the first of those
+    expected = []
+    for line in lines:
+        starts = [(match.start(), i) for i, match in enumerate(re.search(p, line) for p in patterns) if match]
+        if starts:
+            expected.append((line, patterns[min(starts)[1]]))
+    for options in ({}, {'mmap': True}, {'compact': True}, {'compact': True, 'mmap': True}):
+        results = list(grep(patterns, str(path), **options).eval())
+        assert [(result.line, result.pattern) for result in results] == expected, options
+
+@pytest.mark.parametrize('pattern', PATTERNS + list(UNCOMBINABLE.values()), ids=repr)
+@pytest.mark.parametrize('name', CONTENTS)
+def test_compact_matches_eval(tmp_path, name, pattern):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(CONTENTS[name])
+    for options in ({'n': True}, {'n': True, 'mmap': True}, {'v': True}):
+        assert list(grep(pattern, str(path), compact=True, **options).eval()) == \
+               list(grep(pattern, str(path), **options).eval()), options
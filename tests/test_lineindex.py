@@ -0,0 +1,66 @@
+# test_lineindex.py
+# checks that cat with lines gives the same lines as cat does, through the line index, and that the index lasts
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import clinix
+import lineindex
+from cat import cat
+
+CONTENTS = {
+    'lf': b'a\nb\n\nc\nd\n',
+    'crlf': b'a\r\nb\r\n\r\nc\r\nd\r\n',
+    'no final newline': b'a\nb\n\nc\nd',
+    'lone cr': b'a\rb\nc\r\rd\n',
+    'cr at the end': b'a\nb\r',
+    'empty': b'',
+}
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    """
+    scans in blocks of a few bytes, so line breaks (and '\\r\\n's) get split between them
+    """
+
+    monkeypatch.setattr(clinix, 'BLOCK_SIZE', 3)
+    lineindex.cache.clear()
+
+@pytest.mark.parametrize('name', CONTENTS)
+def test_lines_are_the_lines_of_cat(tmp_path, name):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(CONTENTS[name])
+    lines = str(cat(str(path))).split('\n')
+    numbered = str(cat(str(path), n=True)).split('\n')
+    for first in range(1, 6):
+        for last in range(first, 7):
+            assert str(cat(str(path), lines=(first, last))).split('\n') == (lines[first - 1:last] or ['']), (first, last)
+            assert str(cat(str(path), lines=(first, last), n=True)).split('\n') == (numbered[first - 1:last] or ['']), (first, last)
+
+@pytest.mark.parametrize('name', CONTENTS)
+def test_appending_indexes_like_scanning_again(tmp_path, name):
+    path = tmp_path / 'f.txt'
+    data = CONTENTS[name] + b'\ne\r\nf\r'
+    for cut in range(len(data) + 1):
+        path.write_bytes(data[:cut])
+        index = lineindex.LineIndex(str(path)).update()
+        with open(path, 'ab') as f:
+            f.write(data[cut:])
+        assert list(index.update().ends) == list(lineindex.LineIndex(str(path)).update().ends), cut
+
+def test_sidecar_is_saved_when_missing(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(CONTENTS['lf'])
+    sidecar = lineindex.sidecar_path(str(path))
+    lineindex.line_index(str(path))
+    lineindex.line_index(str(path), sidecar=True)
+    assert os.path.exists(sidecar)
+    os.remove(sidecar)
+    lineindex.line_index(str(path), sidecar=True)
+    assert os.path.exists(sidecar)
+    lineindex.cache.clear()
+    assert list(lineindex.line_index(str(path), sidecar=True).ends) == [2, 4, 5, 7, 9]
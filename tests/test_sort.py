@@ -0,0 +1,64 @@
+# test_sort.py
+# checks that sort gives the same lines as sorted() does, however many runs it's spilled into
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sort import sort, SortKey, unique_lines
+
+def make_lines(n, seed=0):
+    """
+    lines of a few fields, with plenty of numbers and keys that are the same, and some with few fields
+    """
+
+    rng = random.Random(seed)
+    words = ['apple', 'Banana', 'cherry', 'date', 'é', '']
+    lines = []
+    for i in range(n):
+        fields = [rng.choice(words), str(rng.randint(-50, 50)), '{:.2f}'.format(rng.uniform(-5, 5)), str(i)]
+        lines.append(' '.join(fields[:rng.randint(1, 4)]))
+    return lines
+
+def expected(lines, k=None, t=None, n=False, r=False, u=False):
+    key = SortKey(k, t, n) if k is not None or t is not None or n else None
+    result = sorted(lines, key=key, reverse=r)
+    return list(unique_lines(result, key)) if u else result
+
+OPTIONS = [{}, {'r': True}, {'u': True}, {'n': True}, {'k': 2, 'n': True}, {'k': 2, 'n': True, 'r': True},
+           {'k': 1, 'u': True}, {'k': 2, 'n': True, 'u': True}, {'k': 3, 'n': True, 'r': True, 'u': True},
+           {'k': 2, 't': ' '}, {'k': 1, 'r': True, 'u': True}]
+
+@pytest.mark.parametrize('options', OPTIONS, ids=repr)
+@pytest.mark.parametrize('buffersize', [None, 500, 5000], ids=['one run', 'many runs', 'a few runs'])
+def test_sort_matches_sorted(tmp_path, options, buffersize):
+    lines = make_lines(1000)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    if buffersize is not None:
+        options = dict(options, S=buffersize)
+    assert list(sort(str(path), **options).eval()) == expected(lines, **{k: v for k, v in options.items() if k != 'S'})
+
+@pytest.mark.parametrize('options', [{}, {'k': 2, 'n': True, 'r': True, 'u': True}], ids=repr)
+def test_sort_jobs(tmp_path, options):
+    lines = make_lines(2000, seed=1)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    assert list(sort(str(path), S=1000, jobs=2, **options).eval()) == expected(lines, **options)
+
+def test_sort_keeps_tabs_in_runs(tmp_path):
+    lines = ['b\tx', 'a\tb', 'c', 'a', 'b\tx', 'a\t'] * 50
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    assert list(sort(str(path), S=100).eval()) == sorted(lines)
+
+def test_sort_several_files(tmp_path):
+    first, second = make_lines(300, seed=2), make_lines(300, seed=3)
+    (tmp_path / 'a.txt').write_text('\n'.join(first) + '\n', encoding='utf-8')
+    (tmp_path / 'b.txt').write_text('\n'.join(second), encoding='utf-8')
+    files = [str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')]
+    assert list(sort(*files, S=500, k=2, n=True).eval()) == expected(first + second, k=2, n=True)
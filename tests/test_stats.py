@@ -0,0 +1,36 @@
+# test_stats.py
+# checks that commands count the bytes they read from their files once, as they read them
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import clinix
+from cat import cat
+from grep import grep
+from tac import tac
+from wc import wc
+
+def write_lines(path, n):
+    path.write_bytes(b''.join(b'line %d\n' % i for i in range(n)))
+    return path.stat().st_size
+
+def test_whole_file_is_counted_once(tmp_path):
+    size = write_lines(tmp_path / 'f.txt', 100000)
+    f = str(tmp_path / 'f.txt')
+    for command in (cat(f), wc(f), grep('line 5', f), grep('line 5', f, mmap=True)):
+        str(command)
+        assert command.stats.bytes_read == size, command
+    command = cat(f) > str(tmp_path / 'out.txt')
+    command.do()
+    assert command.stats.bytes_read == size
+    command = tac(f)
+    str(command)
+    assert size <= command.stats.bytes_read < size + clinix.BLOCK_SIZE
+
+def test_tac_with_n_counts_only_the_tail(tmp_path):
+    size = write_lines(tmp_path / 'f.txt', 400000)
+    command = tac(str(tmp_path / 'f.txt'), n=1)
+    str(command)
+    assert 0 < command.stats.bytes_read < size
@@ -0,0 +1,80 @@
+# test_uniq.py
+# checks that uniq counts lines the same as Counter does, however many times it spills them
+
+import itertools
+import os
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import uniq as uniq_module
+from uniq import uniq, UniqSuccess
+
+def make_lines(n, distinct, seed=0):
+    rng = random.Random(seed)
+    return ['line {}'.format(rng.randrange(distinct)) for _ in range(n)]
+
+@pytest.fixture
+def levels(monkeypatch):
+    """
+    spills to a few partitions, and records the level of each spill
+    """
+
+    monkeypatch.setattr(uniq_module, 'PARTITIONS', 4)
+    levels = []
+    spill = uniq_module.spill
+    def recorded_spill(totals, partitions, level):
+        levels.append(level)
+        spill(totals, partitions, level)
+    monkeypatch.setattr(uniq_module, 'spill', recorded_spill)
+    return levels
+
+def test_unsorted_without_spilling_keeps_first_seen_order(tmp_path):
+    lines = make_lines(1000, 50)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    assert list(uniq(str(path), unsorted=True).eval()) == [UniqSuccess(*item) for item in Counter(lines).items()]
+
+@pytest.mark.parametrize('buffersize', [3000, 1000, 1])
+def test_unsorted_spills_match_counter(tmp_path, levels, buffersize):
+    lines = make_lines(3000, 500)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    results = list(uniq(str(path), unsorted=True, S=buffersize).eval())
+    assert len(results) == len(set(lines))
+    assert dict(results) == Counter(lines)
+    assert max(levels) >= 1 # partitions were spilled again, at least once
+
+def test_unsorted_spills_up_to_max_level(tmp_path, levels):
+    lines = make_lines(2000, 300)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    assert dict(uniq(str(path), unsorted=True, S=1).eval()) == Counter(lines)
+    assert max(levels) == uniq_module.MAX_LEVEL - 1
+
+@pytest.mark.parametrize('options', [{'d': True}, {'u': True}], ids=repr)
+def test_unsorted_repeated_and_unique(tmp_path, levels, options):
+    lines = make_lines(600, 500)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    keep = (lambda count: count > 1) if options.get('d') else (lambda count: count == 1)
+    results = list(uniq(str(path), unsorted=True, S=1000, **options).eval())
+    assert dict(results) == {line: count for line, count in Counter(lines).items() if keep(count)}
+
+def test_spilled_lines_keep_carriage_returns_and_tabs(levels):
+    lines = ['a\rb', 'a', 'b', 'tab\tin it', '\t', '\r', 'a\rb', 'count\t3', 'ends in\r'] * 40 + \
+            ['x{}\ry\tz'.format(i) for i in range(200)]
+    command = uniq(unsorted=True, S=500)
+    assert dict(command.aggregate((line, 1) for line in lines)) == Counter(lines)
+    assert levels
+
+def test_sorted_counts_runs(tmp_path):
+    lines = make_lines(500, 5)
+    path = tmp_path / 'f.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    runs = [UniqSuccess(line, len(list(group))) for line, group in itertools.groupby(lines)]
+    assert list(uniq(str(path)).eval()) == runs
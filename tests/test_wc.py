@@ -0,0 +1,42 @@
+# test_wc.py
+# checks wc's counts, with and without numpy
+
+import codecs
+import locale
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import wc as wc_module
+from wc import wc
+
+CONTENTS = [b'', b'\n', b'one two\nthree', 'ça va\n  cé\tcà \n'.encode('utf-8'), b'bad \xff\xfe bytes\n']
+
+def kernels():
+    yield False
+    if wc_module.numpy is not None:
+        yield True
+
+@pytest.mark.parametrize('data', CONTENTS, ids=repr)
+@pytest.mark.parametrize('use_numpy', list(kernels()))
+def test_counts(tmp_path, data, use_numpy):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(data)
+    text = data.decode(locale.getpreferredencoding(False), 'replace')
+    lines = data.count(b'\n') + (data[-1:] not in (b'', b'\n'))
+    [result] = wc(str(path), l=True, w=True, c=True, m=True, numpy=use_numpy).eval()
+    assert result[1:] == (lines, len(data.split()), len(data), len(text))
+
+@pytest.mark.parametrize('use_numpy', list(kernels()))
+def test_chars_are_only_decoded_when_asked_for(tmp_path, monkeypatch, use_numpy):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(CONTENTS[3])
+    def no_decoder(encoding):
+        raise AssertionError('decoded without counting chars')
+    monkeypatch.setattr(codecs, 'getincrementaldecoder', no_decoder)
+    [result] = wc(str(path), numpy=use_numpy).eval()
+    assert result.chars == 0
+    assert result.bytes == len(CONTENTS[3])